@@ -0,0 +1,96 @@
+"""
+Benchmark the compiled color lookup tables against per pixel ramp
+interpolation and gdaldem color-relief.
+
+Usage: python benchmarks/bench_colormap.py [size] [color_map]
+
+A size x size (default 4096) random DTM spanning the ramp (and a little
+beyond) is colored with color_maps/<color_map>.txt (default
+Rainbow_Saturated).  The throughput of the per pixel interpolation of
+texture.colorrelief, the ColorLUT and, when GDAL is installed,
+gdal.DEMProcessing color-relief on /vsimem/ is reported in Mpx/s, with the
+number of output values that differ from the interpolated ramp and the
+largest difference.
+"""
+import os
+import sys
+import time
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import colormap
+
+
+def interp(z, stops, colors, nodata, out):
+    #texture.colorrelief, without the GDAL import of texture.py
+    invalid = numpy.isnan(z)
+    for band in range(3):
+        channel = numpy.interp(z, stops, colors[:, band].astype(numpy.float64))
+        channel += 0.45
+        with numpy.errstate(invalid='ignore'):
+            numpy.copyto(out[band], channel, casting='unsafe')
+        out[band][invalid] = 0 if nodata is None else nodata[band]
+    return out
+
+
+def report(name, out, elapsed, mpx, reference):
+    diff = numpy.abs(reference.astype(numpy.int16) - out)
+    print("{:<10}{:>10.1f} Mpx/s {:>10} values differ, by at most {}".format(
+        name, mpx / elapsed, int(numpy.count_nonzero(diff)), int(diff.max())))
+
+
+def gdaldem(z, color_file):
+    from osgeo import gdal, gdal_array
+    src = gdal_array.OpenArray(z)
+    src.GetRasterBand(1).SetNoDataValue(-32768)
+    start = time.perf_counter()
+    dst = gdal.DEMProcessing('/vsimem/bench_colormap.tif', src, 'color-relief',
+                             colorFilename=color_file)
+    out = dst.ReadAsArray()
+    elapsed = time.perf_counter() - start
+    dst = None
+    gdal.Unlink('/vsimem/bench_colormap.tif')
+    return out, elapsed
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    name = sys.argv[2] if len(sys.argv) > 2 else 'Rainbow_Saturated'
+    color_file = os.path.join(ROOT, 'color_maps', name + '.txt')
+    ramp = colormap.ColorMap(color_file)
+    rng = numpy.random.RandomState(0)
+    zmin, zmax = -8000.0, 6000.0
+    stops, colors = ramp.getstops(zmin, zmax)
+    pad = 0.05 * (stops[-1] - stops[0])
+    z = rng.uniform(stops[0] - pad, stops[-1] + pad, (size, size)).astype(numpy.float32)
+    z[0], z[-1] = zmin, zmax
+    mpx = size * size / 1e6
+    print("{0}x{0} pixels, {1}".format(size, name))
+
+    reference = numpy.empty((3, size, size), dtype=numpy.uint8)
+    start = time.perf_counter()
+    interp(z, stops, colors, ramp.nodata, reference)
+    report('interp', reference, time.perf_counter() - start, mpx, reference)
+
+    start = time.perf_counter()
+    lut = colormap.compilelut(ramp, zmin, zmax)
+    print("{:<10}{:>10.1f} ms for {} levels".format('compile', (time.perf_counter() - start) * 1e3, lut.levels))
+    out = numpy.empty_like(reference)
+    index = numpy.empty(z.shape, dtype=numpy.intp)
+    work = numpy.empty(z.shape, dtype=numpy.float64)
+    start = time.perf_counter()
+    lut.apply(z, out, index, work)
+    report('lut', out, time.perf_counter() - start, mpx, reference)
+
+    try:
+        out, elapsed = gdaldem(z, color_file)
+    except ImportError:
+        print("{:<10}{:>10} (GDAL is not installed)".format('gdaldem', '-'))
+    else:
+        report('gdaldem', out[:3], elapsed, mpx, reference)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark texture.hillshade against gdaldem hillshade and check that both
+agree around no data.
+
+Usage: python benchmarks/bench_hillshade.py [size] [holes]
+
+A size x size (default 4096) random DTM with holes (default 1000) single
+pixel no data holes is hill-shaded by texture.hillshade and by
+gdal.DEMProcessing on /vsimem/.  The throughput of both is reported in
+Mpx/s, with the number of output values that differ from gdaldem, the
+largest difference and the number of holes not shaded 0.
+"""
+import os
+import sys
+import time
+import types
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#Import texture.py without the add-on's __init__, which needs bpy
+package = types.ModuleType('spaceblender')
+package.__path__ = [ROOT]
+sys.modules['spaceblender'] = package
+from spaceblender import texture
+
+from osgeo import gdal, gdal_array
+
+NODATA = -32768
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    holes = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = numpy.random.RandomState(0)
+    y, x = numpy.mgrid[0:size, 0:size].astype(numpy.float32) / size
+    z = 2000 * numpy.sin(7 * x) * numpy.cos(5 * y)
+    z += rng.normal(0, 5, z.shape).astype(numpy.float32)
+    #Single pixel holes away from the edges, every neighbor valid
+    rows = rng.randint(2, size - 2, holes)
+    cols = rng.randint(2, size - 2, holes)
+    z[rows, cols] = NODATA
+    mpx = size * size / 1e6
+    print("{0}x{0} pixels, {1} holes".format(size, holes))
+
+    src = gdal_array.OpenArray(z)
+    #North up unit pixels, as texture.hillshade is called below.  The MEM
+    #default geotransform is south up, which flips the y gradient.
+    src.SetGeoTransform((0, 1, 0, 0, 0, -1))
+    src.GetRasterBand(1).SetNoDataValue(NODATA)
+    start = time.perf_counter()
+    dst = gdal.DEMProcessing('/vsimem/bench_hillshade.tif', src, 'hillshade')
+    reference = dst.ReadAsArray()
+    elapsed = time.perf_counter() - start
+    dst = None
+    gdal.Unlink('/vsimem/bench_hillshade.tif')
+    print("{:<10}{:>10.1f} Mpx/s".format('gdaldem', mpx / elapsed))
+
+    #A NaN halo, as texture.build reads past the raster edges
+    win = numpy.full((size + 2, size + 2), numpy.nan, dtype=numpy.float32)
+    win[1:-1, 1:-1] = z
+    win[win == NODATA] = numpy.nan
+    out = numpy.empty((size, size), dtype=numpy.uint8)
+    start = time.perf_counter()
+    texture.hillshade(win, 1.0, -1.0, out)
+    elapsed = time.perf_counter() - start
+    diff = numpy.abs(reference.astype(numpy.int16) - out)
+    print("{:<10}{:>10.1f} Mpx/s {:>10} values differ, by at most {}, {} holes shaded".format(
+        'hillshade', mpx / elapsed, int(numpy.count_nonzero(diff)), int(diff.max()),
+        int(numpy.count_nonzero(out[rows, cols]))))
+
+
+if __name__ == '__main__':
+    main()
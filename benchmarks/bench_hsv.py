@@ -0,0 +1,98 @@
+"""
+Benchmark the float32 hsv_merge kernels against the float64 kernels they
+replaced.
+
+Usage: python benchmarks/bench_hsv.py [size] [block]
+
+A size x size (default 4096) random color relief and hillshade are merged
+in blocks of block pixels (default 2**20), as hsv_merge.merge does.  The
+throughput of both kernels is reported in Mpx/s, with the number of output
+values that differ and the largest difference.
+"""
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hsv_merge
+
+
+def legacy_rgb_to_hsv(r, g, b):
+    maxc = numpy.maximum(r, numpy.maximum(g, b))
+    minc = numpy.minimum(r, numpy.minimum(g, b))
+    v = maxc
+    minc_eq_maxc = numpy.equal(minc, maxc)
+    ones = numpy.ones((r.shape[0], r.shape[1]))
+    maxc_minus_minc = numpy.choose(minc_eq_maxc, (maxc - minc, ones))
+    s = (maxc - minc) / numpy.maximum(ones, maxc)
+    rc = (maxc - r) / maxc_minus_minc
+    gc = (maxc - g) / maxc_minus_minc
+    bc = (maxc - b) / maxc_minus_minc
+    maxc_is_r = numpy.equal(maxc, r)
+    maxc_is_g = numpy.equal(maxc, g)
+    maxc_is_b = numpy.equal(maxc, b)
+    h = numpy.zeros((r.shape[0], r.shape[1]))
+    h = numpy.choose(maxc_is_b, (h, 4.0 + gc - rc))
+    h = numpy.choose(maxc_is_g, (h, 2.0 + rc - bc))
+    h = numpy.choose(maxc_is_r, (h, bc - gc))
+    h = numpy.mod(h / 6.0, 1.0)
+    return numpy.asarray([h, s, v])
+
+
+def legacy_hsv_to_rgb(hsv):
+    h = hsv[0]
+    s = hsv[1]
+    v = hsv[2]
+    i = (h * 6.0).astype(int)
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    r = i.choose(v, q, p, p, t, v)
+    g = i.choose(t, v, v, q, p, p)
+    b = i.choose(p, p, t, v, v, q)
+    return numpy.asarray([r, g, b]).astype(numpy.uint8)
+
+
+def legacy_merge(color, hill, out):
+    hsv = legacy_rgb_to_hsv(color[0], color[1], color[2])
+    out[:] = legacy_hsv_to_rgb(numpy.asarray([hsv[0], hsv[1], hill]))
+
+
+def float32_merge(color, hill, out, work):
+    hsv_merge.mergeblock(color, hill, None, out, work)
+
+
+def run(merge, color, hill, rows, *args):
+    out = numpy.empty_like(color)
+    start = time.perf_counter()
+    for y in range(0, color.shape[1], rows):
+        merge(color[:, y:y + rows], hill[y:y + rows], out[:, y:y + rows], *args)
+    return out, time.perf_counter() - start
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    block = int(sys.argv[2]) if len(sys.argv) > 2 else 2 ** 20
+    rows = max(1, block // size)
+    rng = numpy.random.RandomState(0)
+    color = rng.randint(0, 256, (3, size, size)).astype(numpy.uint8)
+    hill = rng.randint(0, 256, (size, size)).astype(numpy.uint8)
+    mpx = size * size / 1e6
+    print("{0}x{0} pixels in blocks of {1} rows".format(size, rows))
+
+    before, elapsed = run(legacy_merge, color, hill, rows)
+    print("{:<10}{:>10.1f} Mpx/s".format('float64', mpx / elapsed))
+    work = hsv_merge.Workspace((rows, size))
+    after, elapsed = run(float32_merge, color, hill, rows, work)
+    print("{:<10}{:>10.1f} Mpx/s".format('float32', mpx / elapsed))
+
+    diff = numpy.abs(before.astype(numpy.int16) - after)
+    print("{} of {} values differ, by at most {}".format(
+        int(numpy.count_nonzero(diff)), diff.size, int(diff.max())))
+
+
+if __name__ == '__main__':
+    main()
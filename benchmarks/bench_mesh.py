@@ -0,0 +1,68 @@
+"""
+Benchmark building the DTM mesh from numpy buffers with foreach_set against
+the lists handed to from_pydata it replaced.
+
+Usage: blender -b -P benchmarks/bench_mesh.py -- [size]
+
+A size x size (default 4096) random vertex grid is built into a mesh both
+ways, as blender_module.buildgrid does.  The time each takes, from the
+vertex array to the updated mesh, is reported with the number of vertices
+and polygons, which must match.
+"""
+import os
+import sys
+import time
+import types
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#Import blender_module.py without the add-on's __init__, which registers it
+package = types.ModuleType('spaceblender')
+package.__path__ = [ROOT]
+sys.modules['spaceblender'] = package
+from spaceblender import blender_module
+
+import bpy
+
+
+def legacy(name, verts_ar, nx, ny):
+    verts = verts_ar.reshape(-1, 3).tolist()
+    idx_ar = numpy.arange((ny - 1) * nx)
+    idx_truth = (idx_ar + 1) % nx != 0
+    v_idx = idx_ar[idx_truth].reshape(-1, 1)
+    faces_ar = numpy.hstack((v_idx + nx,
+                             v_idx + nx + 1,
+                             v_idx + 1,
+                             v_idx))
+    faces = faces_ar.tolist()
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(verts, [], faces)
+    mesh.update(calc_edges=True)
+    return mesh
+
+
+def buffers(name, verts_ar, nx, ny):
+    return blender_module.buildmesh(name, verts_ar, blender_module.gridfaces(nx, ny))
+
+
+def main():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    size = int(argv[0]) if len(argv) > 0 else 4096
+    verts_ar = numpy.empty((size, size, 3), dtype=numpy.float32)
+    verts_ar[:, :, 0] = numpy.arange(size)
+    verts_ar[:, :, 1] = numpy.arange(size)[:, numpy.newaxis]
+    verts_ar[:, :, 2] = numpy.random.RandomState(0).uniform(0, 100, (size, size))
+    print("{0}x{0} vertices".format(size))
+
+    for name, build in [('from_pydata', legacy), ('foreach_set', buffers)]:
+        start = time.perf_counter()
+        mesh = build(name, verts_ar, size, size)
+        elapsed = time.perf_counter() - start
+        print("{:<12}{:>10.2f} s {:>12} vertices {:>12} polygons".format(
+            name, elapsed, len(mesh.vertices), len(mesh.polygons)))
+        bpy.data.meshes.remove(mesh)
+
+
+if __name__ == '__main__':
+    main()
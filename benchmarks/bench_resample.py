@@ -0,0 +1,82 @@
+"""
+Benchmark the resample module against the PIL based resize that
+scipy.misc.imresize(mode='F') wrapped.
+
+Usage: python benchmarks/bench_resample.py [size] [scale]
+
+A size x size synthetic float32 DTM (default 10000) with NaN holes is
+resampled by scale (default 0.5) with each interpolation method.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import resample
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def synthetic_dtm(size):
+    """
+    Smooth terrain with a few no data holes, in meters
+    """
+    y, x = np.ogrid[0:size, 0:size]
+    arr = np.empty((size, size), dtype=np.float32)
+    arr[:] = 500 * np.sin(x / 350.0).astype(np.float32)
+    arr += (300 * np.cos(y / 500.0)).astype(np.float32)
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        cx, cy = rng.randint(0, size, 2)
+        arr[max(cy - 50, 0):cy + 50, max(cx - 50, 0):cx + 50] = np.nan
+    return arr
+
+
+def timed(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def pil_resize(arr, size, interpolation):
+    filters = {'nearest': Image.NEAREST, 'bilinear': Image.BILINEAR,
+               'cubic': Image.BICUBIC}
+    im = Image.fromarray(arr, mode='F')
+    return np.asarray(im.resize(tuple(size), filters[interpolation]))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    arr = synthetic_dtm(size)
+    outsize = [int(size * scale), int(size * scale)]
+    print("Input {0}x{0} float32, output {1}x{1}, {2} cpus".format(
+        size, outsize[0], os.cpu_count()))
+    print("{:<10}{:<12}{:>10}{:>14}{:>12}".format(
+        'method', 'engine', 'seconds', 'peak MB', 'NaN out'))
+
+    for method in ['nearest', 'bilinear', 'cubic', 'area']:
+        rows = []
+        if Image is not None and method != 'area':
+            rows.append(('pil', pil_resize, {}))
+        rows.append(('resample/1', resample.resize, {'workers': 1}))
+        rows.append(('resample/N', resample.resize, {}))
+        for name, func, kwargs in rows:
+            out, elapsed, peak = timed(func, arr, outsize, method, **kwargs)
+            print("{:<10}{:<12}{:>10.2f}{:>14.1f}{:>12}".format(
+                method, name, elapsed, peak / 1024.0 ** 2,
+                int(np.isnan(out).sum())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark the texture encodings: encode time, file size and Blender load and
+pack time.
+
+Usage: python benchmarks/bench_texture.py [size] [color_map]
+       blender -b -P benchmarks/bench_texture.py -- [size] [color_map]
+
+A size x size (default 4096) synthetic DTM, smooth hills with a little
+noise, is textured with color_maps/<color_map>.txt (default
+Rainbow_Saturated) in each of texture.ENCODINGS.  The time texture.build
+takes and the size of the file are reported for each encoding.  Run in
+Blender, the time to load the texture and decode its pixels and the time to
+pack it into the .blend are reported too.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#Import texture.py without the add-on's __init__, which needs bpy
+package = types.ModuleType('spaceblender')
+package.__path__ = [ROOT]
+sys.modules['spaceblender'] = package
+from spaceblender import texture
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+def terrain(size):
+    y, x = numpy.mgrid[0:size, 0:size].astype(numpy.float32) / size
+    z = 2000 * numpy.sin(7 * x) * numpy.cos(5 * y) + 800 * numpy.sin(23 * x + 11 * y)
+    z += numpy.random.RandomState(0).normal(0, 5, z.shape).astype(numpy.float32)
+    return z
+
+
+def blender_load(path):
+    #Load and decode the pixels, then pack, as blender_module.addDTM does
+    start = time.perf_counter()
+    image = bpy.data.images.load(path)
+    image.pixels[0]
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    image.pack()
+    packed = time.perf_counter() - start
+    bpy.data.images.remove(image)
+    return loaded, packed
+
+
+def main():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    size = int(argv[0]) if len(argv) > 0 else 4096
+    name = argv[1] if len(argv) > 1 else 'Rainbow_Saturated'
+    color_file = os.path.join(ROOT, 'color_maps', name + '.txt')
+    from osgeo import gdal_array
+    dem = gdal_array.OpenArray(terrain(size))
+    print("{0}x{0} pixels, {1}".format(size, name))
+    print("{:<10}{:>12}{:>12}{:>12}{:>12}".format('encoding', 'encode ms', 'size MB', 'load ms', 'pack ms'))
+
+    tmp = tempfile.mkdtemp(prefix='bench_texture-')
+    try:
+        for encoding in sorted(texture.ENCODINGS):
+            path = os.path.join(tmp, encoding + texture.ENCODINGS[encoding]['extension'])
+            start = time.perf_counter()
+            outdataset = texture.build(dem, color_file, path, encoding=encoding)
+            outdataset = None
+            encoded = time.perf_counter() - start
+            megabytes = os.path.getsize(path) / 1024.0 ** 2
+            if bpy is None:
+                loaded = packed = '-'
+            else:
+                loaded, packed = ['{:.0f}'.format(t * 1e3) for t in blender_load(path)]
+            print("{:<10}{:>12.0f}{:>12.1f}{:>12}{:>12}".format(
+                encoding, encoded * 1e3, megabytes, loaded, packed))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if bpy is None:
+        print("(run in Blender for the load and pack times)")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,13 +16,13 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
+import math
 import os
 from sys import platform as _platform
 
 import numpy as np
 
 import bpy
-import bmesh
 from bpy.ops import *
 
 from . import flyover_module as flyover
@@ -30,6 +30,14 @@ from . import gdalio
 
 flyovers = {'linear':'LinearPattern'}
 
+#Rough number of bytes held per vertex while a mesh is built: the float32
+#vertex and int32 face arrays and the vertices, edges, loops and polygons
+#Blender builds from them
+VERTEX_BYTES = 160
+
+#Default working set budget for building the DTM mesh
+MESH_MEMORY = 1024 ** 3
+
 def placeobj(mesh, objname):
     """
     Place an object into the scene
@@ -51,6 +59,54 @@ def placeobj(mesh, objname):
     mesh.select = True
     return mesh
 
+def gridfaces(nx, ny):
+    """
+    Quad faces of a grid of ny rows of nx vertices, numbered row by row
+
+    Returns
+    -------
+    faces   (ndarray) (ny - 1, nx - 1, 4) int32 vertex indices, v + nx,
+                      v + nx + 1, v + 1, v for the face at vertex v
+    """
+    faces = np.empty((max(ny - 1, 0), max(nx - 1, 0), 4), dtype=np.int32)
+    first = faces[:, :, 3]
+    first[...] = np.arange(nx - 1, dtype=np.int32)
+    first += (np.arange(ny - 1, dtype=np.int32) * nx)[:, np.newaxis]
+    np.add(first, nx, out=faces[:, :, 0])
+    np.add(first, nx + 1, out=faces[:, :, 1])
+    np.add(first, 1, out=faces[:, :, 2])
+    return faces
+
+def buildmesh(name, verts, faces):
+    """
+    Build a mesh straight from numpy buffers, without the Python lists of
+    from_pydata
+
+    Parameters
+    ----------
+    name    (str) Name of the mesh
+    verts   (ndarray) (..., 3) float32 vertex coordinates
+    faces   (ndarray) (..., 4) int32 quad vertex indices
+
+    Returns
+    -------
+    mesh    (obj) Blender mesh
+    """
+    verts = np.ascontiguousarray(verts, dtype=np.float32).reshape(-1)
+    loops = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1)
+    npolygons = loops.size // 4
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(verts.size // 3)
+    mesh.vertices.foreach_set('co', verts)
+    mesh.loops.add(loops.size)
+    mesh.loops.foreach_set('vertex_index', loops)
+    mesh.polygons.add(npolygons)
+    mesh.polygons.foreach_set('loop_start', np.arange(0, loops.size, 4, dtype=np.int32))
+    mesh.polygons.foreach_set('loop_total', np.full(npolygons, 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    return mesh
+
 class DTMViewerRenderContext:
     """
      This clears the scene and creates:
@@ -67,7 +123,12 @@ class DTMViewerRenderContext:
                  interp_method = None,
                  zscale = 1.0,
                  importmode='DTM',
-                 drapetarget=None):
+                 drapetarget=None,
+                 tiling=None,
+                 mesh_memory=MESH_MEMORY,
+                 read_threads=1,
+                 read_cachemax=None,
+                 job=None):
 
         self.filepath = filepath
         self.texture = dtm_texture
@@ -81,6 +142,12 @@ class DTMViewerRenderContext:
         self.zscale = zscale
         self.import_mode = importmode
         self.obj = drapetarget
+        self.tiling = tiling
+        self.mesh_memory = mesh_memory
+        self.read_threads = read_threads
+        self.read_cachemax = read_cachemax
+        #jobdir.JobDirectory renders and the .blend are written to, None for the cwd
+        self.job = job
 
         print(self.__flyover)
 
@@ -185,14 +252,19 @@ class DTMViewerRenderContext:
 
         bpy.ops.object.transform_apply(rotation=True, scale=True)
 
-        self.basedem = gdalio.ReadGDAL(self.filepath)
-        self.basedem.resize(percentage_reduction=self.image_sample,
-                              interpolation=self.interp_method)
+        #Sample while reading so the full resolution DTM is never in memory
+        self.basedem = gdalio.ReadGDAL(self.filepath,
+                                       image_sample=self.image_sample,
+                                       interpolation=self.interp_method,
+                                       threads=self.read_threads,
+                                       cachemax=self.read_cachemax)
+        if self.tiling is None:
+            self.basedem.load()
+        #Tiled meshes read each tile's rows as they are built, so the DTM
+        #is never loaded as a whole and may be larger than memory
 
         #Setup the mesh
         meshname = self.basedem.name
-        bm = bmesh.new()
-        mesh = bpy.data.meshes.new(meshname)
 
         #Create a material and texture
         material = bpy.data.materials.new(name="DTMSurface")
@@ -214,85 +286,192 @@ class DTMViewerRenderContext:
 
         meshtexture = material.texture_slots.add()
         meshtexture.texture = texture
+        self.dtmtexture = texture
         meshtexture.color=(0.0, 0.0, 0.0)
+        if self.tiling is not None:
+            #Tiles are mapped onto their part of the texture through UVs
+            meshtexture.texture_coords = 'UV'
         #Process the DTM to extract vertices and generate faces
         #Setup the xy grid
-        xsize = self.basedem.arr.shape[1]
-        ysize = self.basedem.arr.shape[0]
+        xsize, ysize = self.basedem.size
 
         #Scaling information
         xscale = abs(self.basedem.worldfile['xpixelsize'])
         yscale = abs(self.basedem.worldfile['ypixelsize'])
+        #The worldfile pixel size already reflects image_sample
         xyzratio = 1 / xscale  # Hard coded to z is in meter units
-        xyzratio *= self.image_sample
-
-        #x, y, z vectors stacked to 3d arr
-        x,y = np.meshgrid((np.arange(xsize)), (np.arange(ysize)))
 
-        #Exaggerate the z
+        #Exaggerate the z and scale it to match the xy ratio.  The DTM keeps
+        #its native data type, the z transform is applied when the vertices
+        #are filled.
         self.basedem.scale(self.zscale)
-        z = self.basedem.arr
-        z *= xyzratio
-        z = np.flipud(z)
-        #Scale the z to match the xy ratio
-        #z *= (1 / (xscale * self.image_scale))
-
-        zmin = np.nanmin(z)
-        zmax = np.nanmax(z)
+        self.basedem.transformz(xyzratio)
 
         #Shift the points to center the image on the blender origin (0,0,0)
-        self.basedem.getpixelextent(x, y)
+        self.basedem.getpixelextent()
         self.basedem.getpixelcenter()
         center = self.basedem.pixelcenter
 
         self.blender_xoffset = center[0]
         self.blender_yoffset = center[1]
+        centerz = center[2]
+        if np.isnan(centerz):
+            #No data under the center pixel, center on the mean instead
+            centerz = self.basedem.getstats()[2]
+        self.basedem.transformz(offset=-centerz)
 
-
-        x -= self.blender_xoffset
-        y -= self.blender_yoffset
-        z -= center[2]
-        self.basedem.pixelcenter[2] = np.nanmean(z)
-
-
-        verts_ar = np.hstack((x.reshape(-1,1),
-                              y.reshape(-1,1),
-                              z.reshape(-1,1)))
-
-        verts = verts_ar.tolist()
-        #generate the faces
-        vertcount = xsize * ysize
-        idx_ar = np.arange((ysize-1)*(xsize))
-        idx_truth = (idx_ar + 1) % xsize != 0
-        v_idx = idx_ar[idx_truth].reshape(-1, 1)
-
-        faces_ar = np.hstack((v_idx + xsize,
-                        v_idx + xsize + 1,
-                        v_idx + 1,
-                        v_idx))
-        faces = faces_ar.tolist()
-
-        #Create the mesh from the verts and faces
-        mesh.from_pydata(verts, [], faces)
-        mesh.update(calc_edges=True)
+        #Reuse the validity mask from the read for all of the z statistics
+        zmin, zmax, zmean = self.basedem.getstats()
+        self.basedem.pixelcenter[2] = zmean
 
         #Capture the min and max values to position the sun
-        self.dtm_min_v = (np.nanmin(x), np.nanmin(y), np.nanmin(z))
-        self.dtm_max_v = (np.nanmax(x), np.nanmax(y), np.nanmax(z))
+        self.dtm_min_v = (-self.blender_xoffset, -self.blender_yoffset, zmin)
+        self.dtm_max_v = (xsize - 1 - self.blender_xoffset,
+                          ysize - 1 - self.blender_yoffset, zmax)
         self.delta_v = tuple(map(lambda a, b: a - b, self.dtm_max_v, self.dtm_min_v))
 
         #self.set_latlon_bounds(self.basedem)
 
-        #Place the mesh in the scene and add the texture
-        mesh = placeobj(mesh, meshname)
-        bpy.ops.object.select_pattern(pattern=meshname)
-        mesh.data.materials.append(material)
+        if self.tiling is None:
+            #Create the mesh from the verts and faces
+            mesh = self.buildgrid(meshname, (0, ysize), (0, xsize))
+
+            #Place the mesh in the scene and add the texture
+            mesh = placeobj(mesh, meshname)
+            mesh.data.materials.append(material)
+        else:
+            self.addtiles(meshname, material)
+        bpy.ops.object.select_pattern(pattern=meshname + '*')
 
         #Adjust the view
         self.adjustview(self.basedem)
 
         return {"FINISHED"}
 
+    def gettiles(self, xsize, ysize):
+        """
+        Split the vertex grid into square tiles that fit the mesh memory
+        budget.  Neighboring tiles share a row or column of vertices so the
+        faces between them are built.
+
+        Parameters
+        ----------
+        xsize       (int) Number of vertex columns
+        ysize       (int) Number of vertex rows
+
+        Returns
+        -------
+        tiles       (list) of ((rowstart, rowstop), (colstart, colstop)),
+                           rows are counted from the south edge
+        """
+        side = max(int(math.sqrt(self.mesh_memory / float(VERTEX_BYTES))), 2)
+        step = side - 1
+        rows = [(start, min(start + side, ysize))
+                for start in range(0, max(ysize - 1, 1), step)]
+        cols = [(start, min(start + side, xsize))
+                for start in range(0, max(xsize - 1, 1), step)]
+        return [(r, c) for r in rows for c in cols]
+
+    def buildgrid(self, name, rows, cols, uv=False):
+        """
+        Build the mesh of a window of the vertex grid.  The z values are
+        pulled from the DTM in row blocks, flipped so north is +y.
+
+        Parameters
+        ----------
+        name        (str) Name of the mesh
+        rows        (tuple) (start, stop) vertex rows, counted from the south
+        cols        (tuple) (start, stop) vertex columns
+        uv          (bool) Add a UV layer placing the window in the texture
+
+        Returns
+        -------
+        mesh        (obj) Blender mesh
+        """
+        xsize, ysize = self.basedem.size
+        rowstart, rowstop = rows
+        colstart, colstop = cols
+        nx = colstop - colstart
+        ny = rowstop - rowstart
+
+        #x, y, z vectors stacked to 3d arr
+        verts_ar = np.empty((ny, nx, 3), dtype=np.float32)
+        verts_ar[:, :, 0] = np.arange(colstart, colstop) - self.blender_xoffset
+        verts_ar[:, :, 1] = (np.arange(rowstart, rowstop) - self.blender_yoffset)[:, np.newaxis]
+        block = max(1, 2 ** 22 // nx)
+        for start in range(rowstart, rowstop, block):
+            stop = min(start + block, rowstop)
+            z = self.basedem.readz((ysize - stop, ysize - start), (colstart, colstop))
+            verts_ar[start - rowstart:stop - rowstart, :, 2] = z[::-1]
+
+        #generate the faces and fill the mesh from the arrays
+        faces_ar = gridfaces(nx, ny)
+        mesh = buildmesh(name, verts_ar, faces_ar)
+
+        if uv:
+            #One UV per loop, loops follow the face vertex order
+            vertuv = np.empty((ny, nx, 2), dtype=np.float32)
+            vertuv[:, :, 0] = np.arange(colstart, colstop) / float(max(xsize - 1, 1))
+            vertuv[:, :, 1] = (np.arange(rowstart, rowstop) / float(max(ysize - 1, 1)))[:, np.newaxis]
+            loopuv = vertuv.reshape(-1, 2)[faces_ar.ravel()]
+            mesh.uv_textures.new('DTMUV')
+            mesh.uv_layers[-1].data.foreach_set('uv', loopuv.ravel())
+        return mesh
+
+    def addtiles(self, meshname, material):
+        """
+        Build the DTM mesh tile by tile, so that only one tile's buffers are
+        in memory at a time.  With tiling 'objects' each tile is an object
+        named meshname_row_col.  With tiling 'join' the tiles are joined into
+        one object and the vertices duplicated along the seams are welded.
+
+        Parameters
+        ----------
+        meshname    (str) Name of the DTM object
+        material    (obj) Material applied to every tile
+        """
+        xsize, ysize = self.basedem.size
+        tiles = self.gettiles(xsize, ysize)
+        print("Building the mesh in %d tiles" % len(tiles))
+
+        objs = []
+        for rows, cols in tiles:
+            name = '%s_%d_%d' % (meshname, rows[0], cols[0])
+            obj = placeobj(self.buildgrid(name, rows, cols, uv=True), name)
+            obj.data.materials.append(material)
+            if self.tiling == 'join':
+                #Tag the tile border, the seams are welded after the join
+                nx = cols[1] - cols[0]
+                ny = rows[1] - rows[0]
+                border = np.zeros((ny, nx), dtype=bool)
+                border[[0, -1], :] = True
+                border[:, [0, -1]] = True
+                group = obj.vertex_groups.new('seam')
+                group.add(np.flatnonzero(border).tolist(), 1.0, 'REPLACE')
+            objs.append(obj)
+
+        if self.tiling != 'join':
+            return
+
+        bpy.ops.object.select_all(action='DESELECT')
+        for obj in objs:
+            obj.select = True
+        bpy.context.scene.objects.active = objs[0]
+        if len(objs) > 1:
+            bpy.ops.object.join()
+        obj = bpy.context.scene.objects.active
+        obj.name = meshname
+        obj.data.name = meshname
+
+        group = obj.vertex_groups['seam']
+        obj.vertex_groups.active_index = group.index
+        bpy.ops.object.mode_set(mode='EDIT')
+        bpy.ops.mesh.select_all(action='DESELECT')
+        bpy.ops.object.vertex_group_select()
+        bpy.ops.mesh.remove_doubles(threshold=1e-4)
+        bpy.ops.object.mode_set(mode='OBJECT')
+        obj.vertex_groups.remove(group)
+
     def adjustview(self, rasterimporter):
         """
         Adjust the view to center on the georeferenced image
@@ -409,30 +588,69 @@ class DTMViewerRenderContext:
         #This assumes only one camera in the scene.
         bpy.context.scene.camera = bpy.data.objects['Camera']
         self.setupRender(resolution)
+        #With a job, render into its scratch directory and publish the finished files
+        if self.job is not None:
+            render_path = self.job.scratch(DTMViewerRenderContext.render_save_path[0])
+        else:
+            render_path = os.getcwd()+'/'+DTMViewerRenderContext.render_save_path[0]
         if animation:
-            bpy.data.scenes["Scene"].render.filepath = os.getcwd()+'/'+\
-                DTMViewerRenderContext.render_save_path[0]
+            bpy.data.scenes["Scene"].render.filepath = render_path
             bpy.ops.render.render(animation=True)
         else:
-            bpy.data.scenes["Scene"].render.filepath = os.getcwd()+'/'+\
-                DTMViewerRenderContext.render_save_path[0]
+            bpy.data.scenes["Scene"].render.filepath = render_path
             bpy.ops.render.render(animation=False, write_still=True)
+        if self.job is not None:
+            self.job.publish_all()
+
+    def settexture(self, path):
+        """
+        Swap the image of the DTM texture, keeping the mesh, camera and
+        flyover path
+
+        Parameters
+        ----------
+        path        (str) PATH to the new texture image
+        """
+        try:
+            self.dtmtexture.image = bpy.data.images.load(path)
+        except:
+            raise NameError("Could not load the texture (image)", path)
+        self.texture = path
 
     def cleanupView(self):
         ## Can't align view because there is no pane to apply the view
         #bpy.ops.view3d.view_all(center=True)
-        bpy.ops.object.select_pattern(pattern=self.basedem.name)
+        bpy.ops.object.select_pattern(pattern=self.basedem.name + '*')
 
 
     def saveAs(self, path):
-        bpy.ops.wm.save_as_mainfile(filepath=path, check_existing=False)
+        if self.job is None:
+            bpy.ops.wm.save_as_mainfile(filepath=path, check_existing=False)
+            return
+        #Save a copy in the scratch directory, the open file stays untitled, then
+        #publish it to path
+        name = os.path.basename(path)
+        bpy.ops.wm.save_as_mainfile(filepath=self.job.scratch(name),
+                                    check_existing=False, copy=True)
+        self.job.publish(name)
 
 
 def load(operator, context, filepath, scale, image_sample, interp_method,
          color_pattern, flyover_pattern, texture_location, cropVars,
-         resolution, stars, mist, render, animation):
+         resolution, stars, mist, render, animation, tiling=None,
+         mesh_memory=MESH_MEMORY, read_threads=1, read_cachemax=None,
+         job=None, extra_textures=None):
     """
     Called by ui_module to fire off an import
+
+    tiling (None, 'join' or 'objects') builds the mesh in tiles that fit
+    mesh_memory bytes, see DTMViewerRenderContext.addtiles.  read_threads and
+    read_cachemax (bytes per thread) configure the DTM read, see
+    gdalio.ReadGDAL.  With a jobdir.JobDirectory job the .blend and renders
+    are published to its output directory instead of the cwd.
+    extra_textures is a list of (name, texture path): once the scene is
+    rendered with texture_location each is swapped in and rendered again as
+    <dtm>_<name>, reusing the mesh and flyover path.
     """
     print("Sampling Perc.: %s" % image_sample)
     print("Scale: %f" % scale)
@@ -444,13 +662,13 @@ def load(operator, context, filepath, scale, image_sample, interp_method,
         save_path = filepath.split('\\')[-1:]
         save_path = save_path[0].split('.')[:1]
         DTMViewerRenderContext.render_save_path = save_path
-        save_path = os.getcwd()+'\\'+save_path[0]+'.blend'
+        save_path = os.path.join(os.getcwd() if job is None else job.output_dir, save_path[0]+'.blend')
         print('Processing image, saving at: ' + save_path)
     else:
         save_path = filepath.split('/')[-1:]
         save_path = save_path[0].split('.')[:1]
         DTMViewerRenderContext.render_save_path = save_path
-        save_path = os.getcwd()+'/'+save_path[0]+'.blend'
+        save_path = os.path.join(os.getcwd() if job is None else job.output_dir, save_path[0]+'.blend')
         print('Processing image, saving at: ' + save_path)
 
     newScene = DTMViewerRenderContext(filepath,resolution, stars, mist,
@@ -458,7 +676,12 @@ def load(operator, context, filepath, scale, image_sample, interp_method,
                                   dtm_flyover = flyover_pattern,
                                   image_sample = image_sample,
                                   interp_method = interp_method,
-                                  zscale = scale)
+                                  zscale = scale,
+                                  tiling = tiling,
+                                  mesh_memory = mesh_memory,
+                                  read_threads = read_threads,
+                                  read_cachemax = read_cachemax,
+                                  job = job)
 
     print('Processing image in Blender, please be patient...')
     newScene.createDefaultContext()
@@ -476,10 +699,6 @@ def load(operator, context, filepath, scale, image_sample, interp_method,
         print("  DTM_TEXTURE:", texture_location)
     except:
         print("Not saving blend file...")
-        rasterimporter = gdalio.ReadGDAL(filepath)
-        rasterimporter.resize(percentage_reduction=image_sample,
-                              interpolation=interp_method)
-        rasterimporter.scale(scale)
 
         #importer = hirise_dtm_importer(context, filepath)
         #importer.bin_mode(bin_mode)
@@ -494,4 +713,13 @@ def load(operator, context, filepath, scale, image_sample, interp_method,
     if render:
         newScene.auto_render(animation, resolution)
 
+    render_save_path = DTMViewerRenderContext.render_save_path
+    for name, path in extra_textures or ():
+        print("Rendering texture %s: %s" % (name, path))
+        newScene.settexture(path)
+        DTMViewerRenderContext.render_save_path = [render_save_path[0] + '_' + name]
+        if render:
+            newScene.auto_render(animation, resolution)
+    DTMViewerRenderContext.render_save_path = render_save_path
+
     return
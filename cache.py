@@ -0,0 +1,255 @@
+"""
+Persistent on-disk caches.
+
+A cache is a directory of entries.  Each entry is a small set of files that
+share a hashed key as their name prefix, with a .json sidecar whose
+modification time records the last use.  When the directory grows past its
+size cap the least recently used entries are evicted.  Files are written
+under a temporary name and renamed into place, so concurrent jobs never see
+a partial entry.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+#Default cache location and size cap, overridden by the environment
+CACHE_DIR = os.environ.get('SPACEBLENDER_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache',
+                                        'spaceblender'))
+CACHE_SIZE = int(os.environ.get('SPACEBLENDER_CACHE_SIZE', 4096)) * 1024 ** 2
+
+
+class DiskCache(object):
+    def __init__(self, directory, maxsize=CACHE_SIZE):
+        """
+        Parameters
+        ----------
+        directory   (str) PATH to the cache directory, created if needed
+        maxsize     (int) Size cap in bytes
+        """
+        self.directory = directory
+        self.maxsize = maxsize
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def getkey(self, *parts):
+        """
+        Hash JSON serializable parts into a key
+
+        Returns
+        -------
+        key     (str) Hex digest
+        """
+        text = json.dumps(parts, sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def readmeta(self, key):
+        """
+        Read the sidecar of an entry and mark it as recently used
+
+        Returns
+        -------
+        meta    (dict) The sidecar, or None on a miss
+        """
+        sidecar = self.path(key, '.json')
+        try:
+            with open(sidecar) as f:
+                meta = json.load(f)
+            os.utime(sidecar, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return meta
+
+    def writemeta(self, key, meta):
+        """
+        Write the sidecar of an entry.  Write it last, the sidecar is what
+        makes an entry visible.
+        """
+        sidecar = self.path(key, '.json')
+        tmp = '{}.tmp-{}'.format(sidecar, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, sidecar)
+        self.evict()
+
+    def entries(self):
+        """
+        List the entries, least recently used first
+
+        Returns
+        -------
+        entries (list) of (last use, size in bytes, files) tuples
+        """
+        entries = []
+        for sidecar in glob.glob(os.path.join(self.directory, '*.json')):
+            key = os.path.basename(sidecar).split('.')[0]
+            files = glob.glob(os.path.join(self.directory, key + '.*'))
+            try:
+                lastuse = os.path.getmtime(sidecar)
+                size = sum(os.path.getsize(f) for f in files)
+            except OSError:
+                continue
+            entries.append((lastuse, size, files))
+        entries.sort(key=lambda e: e[0])
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits its cap
+        """
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for lastuse, size, files in entries:
+            if total <= self.maxsize:
+                break
+            #Drop the sidecar first so the entry disappears atomically
+            for f in sorted(files, key=lambda f: not f.endswith('.json')):
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+            total -= size
+
+
+class DEMCache(DiskCache):
+    """
+    Read, sampled and NDV filled DTM arrays stored as .npy files that are
+    memory mapped on a hit.  Entries are keyed by the source file identity
+    (path, mtime, size) and the crop and sampling used to read it.
+    """
+    def getdemkey(self, path, crop, croptype, image_sample, interpolation):
+        stat = os.stat(path)
+        return self.getkey(os.path.abspath(path), stat.st_mtime, stat.st_size,
+                           crop, croptype, image_sample,
+                           None if interpolation is None else interpolation.lower())
+
+    def load(self, key):
+        """
+        Get a cached array
+
+        Returns
+        -------
+        arr     (ndarray) Copy on write memory map of the array, or None
+        mask    (ndarray) Boolean validity mask
+        meta    (dict) The sidecar
+        """
+        meta = self.readmeta(key)
+        if meta is None:
+            return None, None, None
+        try:
+            arr = np.load(self.path(key, '.npy'), mmap_mode='c')
+            bits = np.load(self.path(key, '.mask.npy'))
+        except (IOError, OSError, ValueError):
+            return None, None, None
+        mask = np.unpackbits(bits)[:arr.size].astype(bool)
+        return arr, mask.reshape(arr.shape), meta
+
+    def store(self, key, arr, mask, meta):
+        """
+        Add an array, its validity mask and its sidecar to the cache.  An
+        array larger than the cache is not stored, it would only evict
+        everything, itself included.
+        """
+        if arr.nbytes > self.maxsize:
+            return
+        for suffix, data in [('.npy', arr), ('.mask.npy', np.packbits(mask))]:
+            final = self.path(key, suffix)
+            tmp = '{}.tmp-{}'.format(final, os.getpid())
+            with open(tmp, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp, final)
+        self.writemeta(key, meta)
+
+
+class TextureCache(DiskCache):
+    """
+    Generated DTM textures stored as the texture files themselves.  Entries
+    are keyed by the DTM identity (path, mtime, size), the contents of the
+    color map and the texture parameters (hillshade settings, format).
+    """
+    def gettexturekey(self, path, color_file, **params):
+        stat = os.stat(path)
+        with open(color_file, 'rb') as f:
+            colors = hashlib.sha1(f.read()).hexdigest()
+        return self.getkey(os.path.abspath(path), stat.st_mtime, stat.st_size,
+                           colors, sorted(params.items()))
+
+    def load(self, key, out_path):
+        """
+        Copy a cached texture to out_path.  The texture is copied, not
+        linked, so rewriting out_path later can not change the entry.
+
+        Returns
+        -------
+        hit     (bool) Was the texture cached?
+        """
+        if self.readmeta(key) is None:
+            return False
+        tmp = '{}.tmp-{}'.format(out_path, os.getpid())
+        try:
+            shutil.copyfile(self.path(key, '.tiff'), tmp)
+            os.replace(tmp, out_path)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        return True
+
+    def store(self, key, texture_path, meta):
+        """
+        Add a copy of the texture at texture_path and its sidecar, unless
+        it is larger than the cache
+        """
+        if os.path.getsize(texture_path) > self.maxsize:
+            return
+        final = self.path(key, '.tiff')
+        tmp = '{}.tmp-{}'.format(final, os.getpid())
+        shutil.copyfile(texture_path, tmp)
+        os.replace(tmp, final)
+        self.writemeta(key, meta)
+
+
+_demcache = None
+_texturecache = None
+
+
+def getdemcache():
+    """
+    Get the default DEM cache, under CACHE_DIR/dem
+
+    Returns
+    -------
+    cache   (obj) The DEMCache, None if CACHE_DIR can not be created
+    """
+    global _demcache
+    if _demcache is None:
+        try:
+            _demcache = DEMCache(os.path.join(CACHE_DIR, 'dem'), CACHE_SIZE)
+        except (IOError, OSError) as e:
+            print('Not caching DTMs: ' + str(e))
+    return _demcache
+
+
+def gettexturecache():
+    """
+    Get the default texture cache, under CACHE_DIR/texture
+
+    Returns
+    -------
+    cache   (obj) The TextureCache, None if CACHE_DIR can not be created
+    """
+    global _texturecache
+    if _texturecache is None:
+        try:
+            _texturecache = TextureCache(os.path.join(CACHE_DIR, 'texture'),
+                                         CACHE_SIZE)
+        except (IOError, OSError) as e:
+            print('Not caching textures: ' + str(e))
+    return _texturecache
@@ -0,0 +1,271 @@
+"""
+Compiled color ramps.
+
+A gdaldem color relief file (color_maps/*.txt) is parsed into a ColorMap and
+compiled into a ColorLUT: the ramp sampled at LEVELS evenly spaced
+elevations between its first and last entries (clipped to the DTM range
+when it is known), plus an entry for no data.  Applying a ramp to a block is
+then a quantization of the elevations and one np.take.  Compiled tables are
+cached per color file and elevation range.
+"""
+import functools
+import os
+import re
+
+import numpy as np
+
+#Named colors understood by gdaldem color-relief
+COLORS = {'white': (255, 255, 255), 'black': (0, 0, 0),
+          'red': (255, 0, 0), 'green': (0, 255, 0), 'blue': (0, 0, 255),
+          'yellow': (255, 255, 0), 'magenta': (255, 0, 255),
+          'cyan': (0, 255, 255), 'aqua': (0, 192, 192),
+          'grey': (190, 190, 190), 'gray': (190, 190, 190),
+          'orange': (255, 127, 0), 'brown': (165, 42, 42),
+          'purple': (160, 32, 240), 'violet': (238, 130, 238),
+          'indigo': (75, 0, 130)}
+
+
+class ColorMap(object):
+    def __init__(self, path):
+        """
+        A gdaldem color relief file: one 'value r g b' entry per line where
+        value is an elevation, a percentage of the DTM range or nv (no data)
+        and the color is given as components or by name.  Text after a /
+        is a comment.
+
+        Parameters
+        ----------
+        path        (str) PATH to the color file
+
+        Attributes
+        ----------
+        values      (list) Entry values, as written
+        percent     (list) Is the matching value a percentage?
+        colors      (ndarray) (n, 3) uint8 entry colors
+        nodata      (tuple) Color of no data pixels, None if not given
+        """
+        self.path = path
+        self.values = []
+        self.percent = []
+        colors = []
+        self.nodata = None
+        with open(path) as f:
+            for line in f:
+                line = line.split('/')[0].strip()
+                if not line:
+                    continue
+                tokens = re.split(r'[\s,:;]+', line)
+                value = tokens[0]
+                color = self.parsecolor(tokens[1:])
+                if value.lower() == 'nv':
+                    self.nodata = color
+                elif value.endswith('%'):
+                    self.values.append(float(value[:-1]))
+                    self.percent.append(True)
+                    colors.append(color)
+                else:
+                    self.values.append(float(value))
+                    self.percent.append(False)
+                    colors.append(color)
+        if not colors:
+            raise ValueError("No color entries in", path)
+        self.colors = np.array(colors, dtype=np.uint8)
+
+    @staticmethod
+    def parsecolor(tokens):
+        """
+        Parse a color name or r g b components, non numeric components are
+        read as 0 like gdaldem does
+        """
+        if len(tokens) == 1 and tokens[0].lower() in COLORS:
+            return COLORS[tokens[0].lower()]
+        color = []
+        for token in (tokens + ['0', '0', '0'])[:3]:
+            try:
+                color.append(min(max(int(float(token)), 0), 255))
+            except ValueError:
+                color.append(0)
+        return tuple(color)
+
+    @property
+    def haspercent(self):
+        return any(self.percent)
+
+    def getstops(self, zmin=None, zmax=None):
+        """
+        Get the entry values in DTM units, sorted
+
+        Parameters
+        ----------
+        zmin        (float) Minimum of the DTM, for percentage entries
+        zmax        (float) Maximum of the DTM, for percentage entries
+
+        Returns
+        -------
+        stops       (ndarray) Sorted float64 entry values
+        colors      (ndarray) (n, 3) uint8 colors of the sorted entries
+        """
+        stops = []
+        for value, percent in zip(self.values, self.percent):
+            if percent:
+                value = zmin + value / 100.0 * (zmax - zmin)
+            stops.append(value)
+        stops = np.array(stops, dtype=np.float64)
+        order = np.argsort(stops, kind='stable')
+        return stops[order], self.colors[order]
+
+
+#Entries of a compiled ramp, the no data color is stored after them.  Ramps
+#with closely spaced entries get up to MAX_LEVELS, so that every segment
+#spans at least SEGMENT_LEVELS entries.
+LEVELS = 2 ** 16
+MAX_LEVELS = 2 ** 22
+SEGMENT_LEVELS = 16
+
+
+class ColorLUT(object):
+    def __init__(self, table, zmin, zmax):
+        """
+        A color ramp sampled at evenly spaced elevations
+
+        Parameters
+        ----------
+        table       (ndarray) (3, levels + 1) uint8 colors, the last column
+                              is the no data color
+        zmin        (float) Elevation of the first column, lower elevations
+                            get its color
+        zmax        (float) Elevation of the last sampled column, higher
+                            elevations get its color
+        """
+        self.table = table
+        self.levels = table.shape[1] - 1
+        self.zmin = zmin
+        self.zmax = zmax
+        if zmax > zmin:
+            self.step = (zmax - zmin) / (self.levels - 1)
+        else:
+            self.step = None
+
+    def index(self, z, out=None, work=None):
+        """
+        Quantize elevations to table columns
+
+        Parameters
+        ----------
+        z           (ndarray) float32 elevations, NaN where there is no data
+        out         (ndarray) intp output of the same shape as z
+        work        (ndarray) float64 scratch of the same shape as z
+
+        Returns
+        -------
+        out         (ndarray) Column of every elevation, levels for no data
+        """
+        if out is None:
+            out = np.empty(z.shape, dtype=np.intp)
+        if work is None:
+            work = np.empty(z.shape, dtype=np.float64)
+        if self.step is None:
+            work.fill(0)
+        else:
+            #Nearest column, clamped to the sampled range
+            np.subtract(z, self.zmin, out=work)
+            work *= 1.0 / self.step
+            work += 0.5
+            np.clip(work, 0, self.levels - 1, out=work)
+        work[np.isnan(z)] = self.levels
+        np.copyto(out, work, casting='unsafe')
+        return out
+
+    def apply(self, z, out, index=None, work=None):
+        """
+        Color elevations
+
+        Parameters
+        ----------
+        z           (ndarray) (rows, cols) float32 elevations, NaN where
+                              there is no data
+        out         (ndarray) (3, rows, cols) uint8 output
+        index       (ndarray) (rows, cols) intp scratch, see index
+        work        (ndarray) (rows, cols) float64 scratch, see index
+
+        Returns
+        -------
+        out         (ndarray) The color relief
+        """
+        index = self.index(z, index, work)
+        np.take(self.table, index, axis=1, out=out)
+        return out
+
+
+def getlevels(stops, lo, hi):
+    """
+    Number of entries so the shortest segment of the ramp within [lo, hi]
+    spans SEGMENT_LEVELS of them, at least LEVELS and at most MAX_LEVELS
+    """
+    gaps = np.diff(np.clip(stops, lo, hi))
+    gaps = gaps[gaps > 0]
+    if hi <= lo or not len(gaps):
+        return LEVELS
+    levels = int(np.ceil((hi - lo) / gaps.min() * SEGMENT_LEVELS)) + 1
+    return min(max(levels, LEVELS), MAX_LEVELS)
+
+
+def compilelut(colormap, zmin=None, zmax=None, levels=None):
+    """
+    Sample a ColorMap into a ColorLUT
+
+    The ramp is linearly interpolated and clamped to its first and last
+    entries and rounded like gdaldem.  Only the range between the first and
+    last entries is sampled, clipped to [zmin, zmax] when given, as the
+    colors are constant outside of it.  Within a ramp segment spanning n
+    entries a color is off by at most (color difference) / 2n.
+
+    Parameters
+    ----------
+    colormap    (obj) ColorMap
+    zmin        (float) Minimum of the DTM, required for percentage entries
+    zmax        (float) Maximum of the DTM, required for percentage entries
+    levels      (int) Number of sampled elevations, None for getlevels
+
+    Returns
+    -------
+    lut         (obj) ColorLUT
+    """
+    stops, colors = colormap.getstops(zmin, zmax)
+    lo = stops[0]
+    hi = stops[-1]
+    if zmin is not None and zmax is not None:
+        lo = min(max(lo, zmin), hi)
+        hi = max(min(hi, zmax), lo)
+    if hi <= lo:
+        levels = 1
+    elif levels is None:
+        levels = getlevels(stops, lo, hi)
+    z = np.linspace(lo, hi, levels)
+    table = np.empty((3, levels + 1), dtype=np.uint8)
+    for band in range(3):
+        channel = np.interp(z, stops, colors[:, band].astype(np.float64))
+        #gdaldem rounds with + 0.45
+        channel += 0.45
+        np.copyto(table[band, :levels], channel, casting='unsafe')
+    nodata = colormap.nodata
+    table[:, levels] = (0, 0, 0) if nodata is None else nodata
+    return ColorLUT(table, float(lo), float(hi))
+
+
+def getlut(path, zmin=None, zmax=None, levels=None):
+    """
+    Get the compiled ramp of a color file, cached per file (path and
+    modification time), elevation range and levels
+
+    Returns
+    -------
+    lut         (obj) ColorLUT, shared, do not modify
+    """
+    path = os.path.abspath(path)
+    return _getlut(path, os.path.getmtime(path), zmin, zmax, levels)
+
+
+@functools.lru_cache(maxsize=32)
+def _getlut(path, mtime, zmin, zmax, levels):
+    return compilelut(ColorMap(path), zmin, zmax, levels)
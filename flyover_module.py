@@ -21,8 +21,8 @@ def no_flyover(mesh):
     minextents = np.asarray(mesh.dtm_min_v)
     maxextents = np.asarray(mesh.dtm_max_v)
     center = mesh.basedem.pixelcenter
-    zcenterelevation = mesh.basedem.arr[mesh.basedem.pixelcenter[1],
-                                    mesh.basedem.pixelcenter[0]]
+    zcenterelevation = mesh.basedem.getpixel(mesh.basedem.pixelcenter[0],
+                                             mesh.basedem.pixelcenter[1])
 
     camera_target = (0,0,zcenterelevation)  #Since we center the DTM, set the camera to the origin
     #Set the position of the camera - center to the long 'edge'
@@ -135,14 +135,16 @@ def getlinear_path(mesh):
         startblendery = yblenderextent
 
         #Extract the topopgraphic profile
-        topoprofile = mesh.basedem.arr[:,startpixelx]
+        topoprofile, valid = mesh.basedem.readzmask((0, mesh.basedem.size[1]),
+                                                    (int(startpixelx), int(startpixelx) + 1))
+        topoprofile = topoprofile[:, 0]
+        valid = valid[:, 0]
         yidx = np.arange(topoprofile.shape[0])
-        mask = np.isnan(topoprofile)
-        startz = topoprofile[~mask][0]
-        endz = topoprofile[~mask][1]
+        startz = topoprofile[valid][0]
+        endz = topoprofile[valid][1]
 
-        validelev = topoprofile[~mask][::10]
-        valididy = yidx[~mask][::10]
+        validelev = topoprofile[valid][::10]
+        valididy = yidx[valid][::10]
 
         centerz = mesh.basedem.pixelcenter[2]
 
@@ -170,14 +172,15 @@ def getlinear_path(mesh):
         startblenderx = int(xblenderextent - (xblenderextent * 0.15))
 
         #Extract the topopgraphic profile
-        topoprofile = mesh.basedem.arr[startpixely]
+        topoprofile, valid = mesh.basedem.readzmask((int(startpixely), int(startpixely) + 1))
+        topoprofile = topoprofile[0]
+        valid = valid[0]
         xidx = np.arange(topoprofile.shape[0])
-        mask = np.isnan(topoprofile)
-        startz = topoprofile[~mask][0]
-        endz = topoprofile[~mask][1]
+        startz = topoprofile[valid][0]
+        endz = topoprofile[valid][1]
 
-        validelev = topoprofile[~mask][::10]
-        valididx = xidx[~mask][::10]
+        validelev = topoprofile[valid][::10]
+        valididx = xidx[valid][::10]
 
         centerz = mesh.basedem.pixelcenter[2]
 
@@ -1,120 +1,103 @@
 '''This class takes in a DEM image and a color mapping file in the form
    GdalModule(<input_dem> <color_text_file>)
-   The script runs the gdaldem hillshade on the image, then runs gdaldem color_relief_map
-   on the image. Once a hillshade and color_relief have been generated the hsv_merge script
-   is called to merge the hillshade and color_relief together. This script produces 3 output
-   images out_hillshade.tiff, out_color.tiff, and DTM_TEXTURE.tiff'''
+   GDALDriver.texture builds DTM_TEXTURE.tiff in a single pass with texture.build: the DEM is
+   hill-shaded, color-relief mapped and merged in HSV in memory, without intermediate hillshade and
+   color_relief images.  Built textures are cached (see cache.TextureCache).
+   Every stage reports its progress to GDALDriver.progress (see progress.py), the console by default.'''
 
 
-import subprocess
-import platform as _platform
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-class GDALDriver(object):
-    def __init__(self, input_dem):
-        self.input_dem = input_dem
+from . import cache as diskcache
+from . import progress as _progress
+from . import texture
 
-    def gdal_hillshade(self, hill_shade):
-    #  Run gdaldem hillshade on the input dem image
-        if _platform.system() == "Windows":
-            hill_sh = 'OSGeo4W gdaldem hillshade '+self.input_dem+' '+hill_shade
-        else:
-            hill_sh = 'gdaldem hillshade '+self.input_dem+' '+hill_shade
-        print('Running Command: ', hill_sh)
-        try:
-            sub_proc1 = subprocess.Popen(hill_sh, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-        #   Print the progress of the GDAL operation to the console to give user feedback
-            while sub_proc1.poll() is None:
-                out = sub_proc1.stdout.read(1)
-                if out != '':
-                    outstr = str(out)
-                    for char in outstr:
-                        if char in " b'":
-                            outstr = outstr.replace(char, '')
-                    sys.stdout.write(outstr)
-                    sys.stdout.flush()
-
-        except subprocess.SubprocessError as e:
-            print('Error: ' + e)
-            print('\nFailed to spawn subprocess for gdal hill-shade')
-            return sys.exit(1)
-        print('\n'+'Hill-Shade created.')
-        return 0
+#texture.build parameters, part of the texture cache key
+TEXTURE_OPTIONS = {'format': 'GTiff', 'z': 1.0, 'scale': 1.0,
+                   'azimuth': 315.0, 'altitude': 45.0,
+                   'lut': True, 'levels': None, 'sample': 1.0,
+                   'max_size': None, 'interpolation': 'cubic',
+                   'encoding': None}
 
-    def gdal_color_relief(self, color_file, color_relief):
-    #   Run gdal color_relief on the input dem image using the color_txt_file supplied
-        if _platform.system() == "Windows":
-            col_rel = 'OSGeo4W gdaldem color-relief '+self.input_dem+' '+color_file+' '+color_relief
-        else:
-            col_rel = 'gdaldem color-relief '+self.input_dem+' '+color_file+' '+color_relief
-        print('Running Command:', col_rel)
-        try:
-            sub_proc2 = subprocess.Popen(col_rel, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+class GDALDriver(object):
+    def __init__(self, input_dem, jobs=1, progress=None, cache=True):
+        self.input_dem = input_dem
+        #Number of threads building the windows of textures
+        self.jobs = jobs
+        #progress.Progress every stage reports to, printing to the console by default
+        if progress is None:
+            progress = _progress.console()
+        self.progress = progress
+        #cache.TextureCache reused by texture, True for the default cache, False to always build
+        if cache is True:
+            cache = diskcache.gettexturecache()
+        self.cache = cache or None
 
-            #Print the progress of the GDAL operation to the console to give user feedback
-            while sub_proc2.poll() is None:
-                out = sub_proc2.stdout.read(1)
-                if out != '':
-                    outstr = str(out)
-                    for char in outstr:
-                        if char in " b'":
-                            outstr = outstr.replace(char, '')
-                    sys.stdout.write(outstr)
-                    sys.stdout.flush()
+    def texture(self, color_file, texture_location, **options):
+    #   Build the texture in one pass over the input dem, hill-shade, color-relief and merge in memory.
+    #   options override TEXTURE_OPTIONS.  A texture cached for the same dem, color file and options
+    #   is copied to texture_location instead.
+        return self.textures([color_file], [texture_location], **options)
 
-        except subprocess.SubprocessError as e:
-            print('Error: ' + e)
-            print('\nFailed to spawn subprocess for gdal color-relief')
-            return sys.exit(1)
-        print('\n'+'Color-Relief created.')
-        return 0
-
-    def hsv_merge(self, merge_location, hill_shade, color_relief, texture_location):
-    #   Merge the hillshade and color-relief using the hsv_merge script
-        if _platform.system() == "Windows":
-            merge = 'OSGeo4W python ' + merge_location+' '+color_relief+' '+hill_shade+' '+texture_location
-        else:
-            merge = 'python ' + merge_location+' '+color_relief+' '+hill_shade+' '+texture_location
-        print('Running Command:', merge)
-        print('This process takes a while. Please be patient...')
+    def textures(self, color_files, texture_locations, **options):
+    #   texture for several color files at once: the textures that are not cached are built in one
+    #   pass over the input dem that hill-shades every window once, the windows are built on
+    #   self.jobs threads.  Exits on failure, textures_async raises instead.
         try:
-            sub_proc3 = subprocess.Popen(merge, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return self.buildtextures(color_files, texture_locations, **options)
+        except (IOError, OSError, ValueError) as e:
+            print('Error: ' + str(e))
+            print('\nFailed to build the texture.')
+            return sys.exit(1)
 
-        #   Print the progress of the hsv_merge operation to the console to give user feedback
-            while sub_proc3.poll() is None:
-                out = sub_proc3.stdout.read(1)
-                if out != '':
-                    outstr = str(out)
-                    for char in outstr:
-                        if char in " b'":
-                            outstr = outstr.replace(char, '')
-                    sys.stdout.write(outstr)
-                    sys.stdout.flush()
+    def texture_async(self, color_file, texture_location, executor=None, **options):
+    #   texture on a worker thread, see textures_async
+        return self.textures_async([color_file], [texture_location], executor, **options)
 
-        except subprocess.SubprocessError as e:
-            print('Error' + e)
-            print('\nFailed to spawn subprocess for hsv_merge.')
-            return sys.exit(1)
-        return 0
+    def textures_async(self, color_files, texture_locations, executor=None, **options):
+    #   textures on a thread of executor, a single worker thread by default.  Returns a
+    #   concurrent.futures.Future of the build, whose result() raises IOError, OSError or ValueError
+    #   on failure, the worker does not exit.
+        owner = executor is None
+        if owner:
+            executor = ThreadPoolExecutor(max_workers=1)
+        built = executor.submit(self.buildtextures, color_files, texture_locations, **options)
+        if owner:
+            #The build still runs, the thread exits once it is done
+            executor.shutdown(wait=False)
+        return built
 
-    def gdal_clean_up(self, hill_shade, color_relief):
-        if _platform.system() == "Windows":
-            clean = 'del '+hill_shade+' '+color_relief
-            print('\nCleaning up Gdal temp images...')
-            try:
-                subprocess.Popen(clean, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            except OSError as e:
-                print('Error: ' + e)
-                print('\nFailed to clean up GDAL temp images.')
-                sys.exit(1)
-        else:
-            clean = 'rm '+hill_shade+' '+color_relief
-            print('\nCleaning up Gdal temp images...')
-            try:
-                subprocess.Popen(clean, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            except OSError as e:
-                print('Error: ' + e)
-                print('\nFailed to clean up GDAL temp images.')
-                return sys.exit(1)
+    def buildtextures(self, color_files, texture_locations, **options):
+    #   The build of textures, raising IOError, OSError or ValueError on failure
+        options = dict(TEXTURE_OPTIONS, **options)
+        keys = {}
+        missing = []
+        for color_file, texture_location in zip(color_files, texture_locations):
+            if self.cache is not None:
+                key = self.cache.gettexturekey(self.input_dem, color_file, **options)
+                if self.cache.load(key, texture_location):
+                    print('Reusing cached texture for', self.input_dem, 'at', texture_location)
+                    continue
+                keys[texture_location] = key
+            missing.append((color_file, texture_location))
+        if not missing:
             return 0
+        for color_file, texture_location in missing:
+            print('Building', texture_location, 'from', self.input_dem, 'with', color_file)
+        texture.buildmany(self.input_dem,
+                          [color_file for color_file, texture_location in missing],
+                          [texture_location for color_file, texture_location in missing],
+                          callback=self.progress.callback('texture'), jobs=self.jobs,
+                          **options)
+        print('Texture created.')
+        for color_file, texture_location in missing:
+            if texture_location not in keys:
+                continue
+            try:
+                self.cache.store(keys[texture_location], texture_location,
+                                 {'dem': self.input_dem, 'color_file': color_file})
+            except (IOError, OSError) as e:
+                print('Could not cache the texture: ' + str(e))
+        return 0
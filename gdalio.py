@@ -1,25 +1,64 @@
+import math
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from osgeo import gdal
-from scipy.misc import imresize
+from osgeo import gdal, gdal_array
+
+from . import cache as diskcache
+from . import rawio
+from . import resample
+
+#GDAL RasterIO resampling for the interpolation names exposed by the UI and
+#the --interp flag.  GDAL reads from an overview when one matches the
+#requested buffer size.
+RESAMPLING = {'nearest': gdal.GRIORA_NearestNeighbour,
+              'linear': gdal.GRIORA_Bilinear,
+              'bilinear': gdal.GRIORA_Bilinear,
+              'area': gdal.GRIORA_Average,
+              'bicubic': gdal.GRIORA_Cubic,
+              'cubic': gdal.GRIORA_Cubic,
+              'lanczos': gdal.GRIORA_Lanczos}
 
 class ReadGDAL():
-    def __init__(self, path, crop=None):
+    def __init__(self, path, crop=None, croptype='pixel', image_sample=1.0,
+                 interpolation='cubic', memmap=True, cache=True, threads=1,
+                 cachemax=None):
         """
         Parameters
         ----------
         path        (str) The PATH to the input DTM
-        crop        (list) The extent to crop the DTM
-                           [xstart, ystart, xsize, ysize]
+        crop        (list) The extent to crop the DTM, either in pixels
+                           [xstart, ystart, xsize, ysize] or in geographic
+                           units [minlon, minlat, maxlon, maxlat]
+        croptype    (str) 'pixel' or 'latlon', how crop is interpreted
+        image_sample (float) Percentage to sub (super) sample the image to
+                             while it is read, e.g. 0.5 for 50%
+        interpolation (str) Resampling used when image_sample != 1
+                            Valid Arguments: nearest, area, linear,
+                            bilinear, bicubic, cubic, lanczos
+        memmap      (bool) Memory map uncompressed PDS3 and ISIS3 pixels
+                           instead of reading them through GDAL
+        cache       (obj) DEMCache holding read arrays, True for the default
+                          cache.getdemcache(), False to always read
+        threads     (int) Number of threads reading strips through GDAL, each
+                          with its own dataset handle
+        cachemax    (int) GDAL block cache per thread in bytes, None leaves
+                          the GDAL cache alone
 
         Attributes
         ----------
         path        (str) PATH to the input file
-        crop        (list) List of pixel or latlon crop coords (not yet impl)
+        crop        (list) List of pixel or latlon crop coords
+        croptype    (str) 'pixel' or 'latlon'
         name        (str) Name of the file without suffix
         inds        (obj) GDAL file object
-        size        (list) [xsize, ysize] - updated on resample
+        image_sample (float) Read time sampling percentage
+        interpolation (str) Read time resampling method
+        window      (list) [xoff, yoff, xsize, ysize] of the source pixels read
+        geotransform (list) GDAL geotransform of the (cropped, sampled) image
+        size        (list) [xsize, ysize] - updated on crop and resample
         worldfile   (dict) Python representation of teh geotransformation
         nband       (int) Number of bands
         band1       (obj) GDAL band proxy object
@@ -34,16 +73,48 @@ class ReadGDAL():
         geocenter   (list) [xcenter, ycenter] in geographic units
         geoext      (list) List of tuples of the corners in lat/long
         pixelextent (dict) Dict of corners keyed by ll, lr, ul, ur
+        arr         (ndarray) The pixels, read on first access or by load().
+                              Integer DTMs keep their native data type,
+                              everything else is float32.
+        zscale      (float) Scale of the z transform applied by getz
+        zoffset     (float) Offset of the z transform applied by getz
+        mask        (ndarray) Boolean validity mask, True where arr holds
+                              data, computed once when the pixels are read
+        memmap      (bool) Memory map raw PDS3 and ISIS3 pixels
+        mapped      (bool) Is arr a view of the raw source file?
+        cache       (obj) DEMCache or None
+        threads     (int) Number of GDAL reader threads
+        cachemax    (int) GDAL block cache per reader thread
 
         """
 
         self.path = path
         self.crop = crop
+        self.croptype = croptype
+        self.image_sample = image_sample
+        self.interpolation = interpolation
+        self.memmap = memmap
+        self.mapped = False
+        if cache is True:
+            cache = diskcache.getdemcache()
+        self.cache = cache or None
+        self.threads = threads
+        self.cachemax = cachemax
         self.name = os.path.basename(path).split('.')[0]
+        self._arr = None
+        self.mask = None
+        self.zscale = 1.0
+        self.zoffset = 0.0
 
         self.inds = gdal.Open(self.path)
         self.size = [self.inds.RasterXSize, self.inds.RasterYSize]
+        self.window = [0, 0, self.size[0], self.size[1]]
+        self.geotransform = list(self.inds.GetGeoTransform())
         self.getworldfile()
+        if self.crop is not None:
+            self.getcropwindow()
+        if self.image_sample != 1.0:
+            self.getsamplesize()
         self.nband = self.inds.RasterCount
         self.band1 = self.inds.GetRasterBand(1)
         self.NDV = self.band1.GetNoDataValue()
@@ -57,17 +128,85 @@ class ReadGDAL():
         self.getgeosize()
         self.getgeocenter()
 
-        #Extract the array and fill the NDV with NaN
+    @property
+    def arr(self):
+        """
+        The pixel array, read and NDV filled the first time it is used
+        """
+        if self._arr is None:
+            self.load()
+        return self._arr
+
+    @arr.setter
+    def arr(self, value):
+        self._arr = value
+
+    @property
+    def isloaded(self):
+        return self._arr is not None
+
+    def load(self):
+        """
+        Extract the array and fill the NDV with NaN.  Only the header is read
+        by the constructor so georeferencing is cheap to get.  With a cache
+        the read, sampled and filled array is stored on the first load and
+        memory mapped from the cache afterwards.
+
+        Returns
+        -------
+        arr     (ndarray) The pixel array
+        """
+        if self._arr is not None:
+            return self._arr
+
+        key = None
+        if self.cache is not None:
+            try:
+                key = self.cache.getdemkey(self.path, self.crop, self.croptype,
+                                           self.image_sample, self.interpolation)
+                arr, mask, meta = self.cache.load(key)
+            except (IOError, OSError) as e:
+                print('Could not read the DTM cache: ' + str(e))
+                key = arr = None
+            if arr is not None and list(arr.shape) == self.size[::-1]:
+                self.arr = arr
+                self.mask = mask
+                return self._arr
+
         self.extractimage()
-        self.fillNDV()
+        if self.mask is None:
+            self.fillNDV()
+        #A view of a raw file is already as cheap as a cache hit
+        if key is not None and not self.mapped:
+            try:
+                self.cache.store(key, self._arr, self.mask, self.getmeta())
+            except (IOError, OSError) as e:
+                print('Could not cache the DTM: ' + str(e))
+        return self._arr
+
+    def getmeta(self):
+        """
+        Georeferencing of the (cropped, sampled) image, stored next to cached
+        arrays
+
+        Returns
+        -------
+        meta    (dict) JSON serializable header
+        """
+        return {'path': os.path.abspath(self.path),
+                'window': [int(v) for v in self.window],
+                'size': [int(v) for v in self.size],
+                'geotransform': [float(v) for v in self.geotransform],
+                'projection': self.projection,
+                'NDV': self.NDV,
+                'dtype': str(self._arr.dtype)}
 
     def getworldfile(self):
         """
         Use the geotransform information to generate an in
         memory worldfile
         """
-        ds = self.inds
-        topleftx, pxsizex, rotx, toplefty, roty, pxsizey = ds.GetGeoTransform()
+        topleftx, pxsizex, rotx, toplefty, roty, pxsizey = self.geotransform
         #Adjust from pixel corner to pixel center
         topleftx += abs(pxsizex / 2.0)
         toplefty -= abs(pxsizey / 2.0)
@@ -79,6 +218,72 @@ class ReadGDAL():
                           'toplefty': toplefty}
         self.origin = [topleftx, toplefty, None]
 
+    def getcropwindow(self):
+        """
+        Convert the crop extent to a pixel window, clipped to the image, and
+        shift the geotransform and size so that they describe the window.
+        """
+        if self.croptype == 'pixel':
+            xstart, ystart, xsize, ysize = [int(c) for c in self.crop]
+            xend = xstart + xsize
+            yend = ystart + ysize
+        elif self.croptype == 'latlon':
+            minlon, minlat, maxlon, maxlat = self.crop
+            corners = [self.latlon2pixel(lon, lat) for lon, lat in
+                       [(minlon, minlat), (minlon, maxlat),
+                        (maxlon, minlat), (maxlon, maxlat)]]
+            xs = [c[0] for c in corners]
+            ys = [c[1] for c in corners]
+            #Keep every pixel whose center falls inside the extent
+            xstart = int(math.ceil(min(xs)))
+            ystart = int(math.ceil(min(ys)))
+            xend = int(math.floor(max(xs))) + 1
+            yend = int(math.floor(max(ys))) + 1
+        else:
+            raise ValueError("croptype must be 'pixel' or 'latlon'", self.croptype)
+
+        xstart = max(xstart, 0)
+        ystart = max(ystart, 0)
+        xend = min(xend, self.inds.RasterXSize)
+        yend = min(yend, self.inds.RasterYSize)
+        if xend <= xstart or yend <= ystart:
+            raise ValueError("The crop extent does not intersect the image", self.crop)
+
+        self.window = [xstart, ystart, xend - xstart, yend - ystart]
+        self.size = self.window[2:]
+
+        gt = self.geotransform
+        gt[0] += xstart * gt[1] + ystart * gt[2]
+        gt[3] += xstart * gt[4] + ystart * gt[5]
+        self.getworldfile()
+
+    def getsamplesize(self):
+        """
+        Compute the output size for the read time sampling percentage and
+        scale the geotransform to the sampled pixel size.
+        """
+        xsize = max(1, int(self.window[2] * self.image_sample))
+        ysize = max(1, int(self.window[3] * self.image_sample))
+        self.scalegeotransform(self.size[0] / float(xsize),
+                               self.size[1] / float(ysize))
+        self.size = [xsize, ysize]
+
+    def scalegeotransform(self, xratio, yratio):
+        """
+        Scale the pixel size of the geotransform, e.g. after a resample
+
+        Parameters
+        ----------
+        xratio      (float) Old columns / new columns
+        yratio      (float) Old rows / new rows
+        """
+        gt = self.geotransform
+        gt[1] *= xratio
+        gt[2] *= yratio
+        gt[4] *= xratio
+        gt[5] *= yratio
+        self.getworldfile()
+
     def getgeosize(self):
         """
         Compute the image size in geographic coordinates
@@ -89,24 +294,26 @@ class ReadGDAL():
         ypixelsize = self.worldfile['ypixelsize']
         self.geosize = [xsize * abs(xpixelsize), ysize * abs(ypixelsize)]
 
-    def getpixelextent(self, x, y):
+    def getpixelextent(self, x=None, y=None):
         """
-        Compute the image size in Blender pixel space
+        Compute the image size in Blender pixel space.  If the array is not
+        loaded only the four corner pixels are read.
 
         Parameters
         -----------
-        x       (ndarray) meshgrid output [[1,2,3], [1,2,3], [...]]
+        x       (ndarray) meshgrid output [[1,2,3], [1,2,3], [...]],
+                          defaults to the image size
         y       (ndarray) meshgrid output [[1,2,3], [1,2,3], [...]]
         """
         xmin = 0
-        xmax = x.shape[1] - 1
+        xmax = (self.size[0] if x is None else x.shape[1]) - 1
         ymin = 0
-        ymax = y.shape[0] - 1
+        ymax = (self.size[1] if y is None else y.shape[0]) - 1
 
-        ul = [xmin, ymin, self.arr[ymin, xmin]]
-        ll = [xmin, ymax, self.arr[ymax, xmin]]
-        lr = [xmax, ymax, self.arr[ymax, xmax]]
-        ur = [xmax, ymin, self.arr[ymin, xmax]]
+        ul = [xmin, ymin, self.getpixel(xmin, ymin)]
+        ll = [xmin, ymax, self.getpixel(xmin, ymax)]
+        lr = [xmax, ymax, self.getpixel(xmax, ymax)]
+        ur = [xmax, ymin, self.getpixel(xmax, ymin)]
         self.pixelextent = {'ul': ul, 'll': ll, 'lr': lr, 'ur': ur}
 
     def getpixelcenter(self):
@@ -116,14 +323,42 @@ class ReadGDAL():
         pxe = self.pixelextent
         centerx = int((pxe['lr'][0] - pxe['ul'][0]) / 2.0)
         centery = int((pxe['lr'][1] - pxe['ul'][1]) / 2.0)
-        centerz = self.arr[centery, centerx]
+        centerz = self.getpixel(centerx, centery)
         self.pixelcenter = [centerx, centery, centerz]
 
+    def getpixel(self, x, y):
+        """
+        Get the value of a single (sampled) pixel.  If the array is not loaded
+        only the source pixels under it are read.
+
+        Parameters
+        ----------
+        x       (int) x pixel value
+        y       (int) y pixel value
+
+        Returns
+        -------
+        value   (float) The pixel value, NaN if it is the NDV
+        """
+        if self.isloaded:
+            return self.getz((y, x))
+
+        xoff, yoff, xsize, ysize = self.window
+        xratio = xsize / float(self.size[0])
+        yratio = ysize / float(self.size[1])
+        value = self.band1.ReadAsArray(xoff + x * xratio, yoff + y * yratio,
+                                       xratio, yratio, 1, 1,
+                                       buf_type=gdal.GDT_Float32,
+                                       resample_alg=getresampling(self.interpolation))[0, 0]
+        if self.NDV is not None and value == self.NDV:
+            return np.nan
+        return value * self.zscale + self.zoffset
+
     def getgeocenter(self):
         """
         Compute the center of the image in geographic space
         """
-        origin = self.geoext[0]  # Upper left
+        origin = self.geoext[3]  # Upper left
         self.geocenter = [origin[0] + self.geosize[0] / 2.0, origin[1] - self.geosize[1] / 2.0]
 
     def getdtype(self):
@@ -143,42 +378,382 @@ class ReadGDAL():
 
     def fillNDV(self):
         """
-        Fill the NDV value with np.NaN
+        Fill the NDV value with np.NaN and record the validity mask.  The
+        array is compared against the NDV once and the result is reused for
+        both the fill and the mask.
+        """
+        if np.issubdtype(self.arr.dtype, np.integer) or self.NDV is None \
+                or np.isnan(self.NDV):
+            #Integer DTMs keep the NDV in place, the mask is authoritative
+            self.mask = self.getvalidmask(self.arr)
+        else:
+            invalid = np.equal(self.arr, self.NDV)
+            np.copyto(self.arr, np.nan, where=invalid)
+            self.mask = np.logical_not(invalid, out=invalid)
+
+    def getvalidmask(self, arr):
+        """
+        Compute a validity mask for an array without modifying it
+
+        Parameters
+        ----------
+        arr     (ndarray) Array in the data type of the band, or float
+
+        Returns
+        -------
+        mask    (ndarray) Boolean array, True where arr holds data
+        """
+        isint = np.issubdtype(arr.dtype, np.integer)
+        if self.NDV is None or np.isnan(self.NDV):
+            if isint:
+                return np.ones(arr.shape, dtype=bool)
+            return ~np.isnan(arr)
+        return np.not_equal(arr, self.NDV)
+
+    def getstats(self):
+        """
+        Compute the statistics of the valid pixels using the validity mask.
+        The statistics are computed on the stored array and then passed
+        through the z transform.
+
+        Returns
+        -------
+        zmin    (float) Minimum valid value
+        zmax    (float) Maximum valid value
+        zmean   (float) Mean of the valid values
+        """
+        #Reduce the valid pixels in row blocks, so only a block is copied.
+        #If the array is not loaded the blocks are read, see readrows.
+        count = 0
+        rawmin, rawmax, rawsum = np.inf, -np.inf, 0.0
+        ysize = self.size[1]
+        block = max(1, 2 ** 22 // max(self.size[0], 1))
+        for start in range(0, ysize, block):
+            stop = min(start + block, ysize)
+            if self.isloaded:
+                arr, mask = self.arr[start:stop], self.mask[start:stop]
+            else:
+                arr, mask = self.readrows((start, stop))
+            valid = arr[mask]
+            if valid.size == 0:
+                continue
+            count += valid.size
+            rawmin = min(rawmin, float(valid.min()))
+            rawmax = max(rawmax, float(valid.max()))
+            rawsum += float(valid.sum(dtype=np.float64))
+        if count == 0:
+            return np.nan, np.nan, np.nan
+        rawmean = rawsum / count
+
+        zmin, zmax = sorted([rawmin * self.zscale + self.zoffset,
+                             rawmax * self.zscale + self.zoffset])
+        zmean = rawmean * self.zscale + self.zoffset
+        return zmin, zmax, zmean
+
+    def getz(self, key=Ellipsis):
+        """
+        Get elevations with the z transform applied.  The conversion to
+        float happens here, on just the requested pixels, so callers should
+        work through large arrays in blocks.
+
+        Parameters
+        ----------
+        key     (obj) Index into the array, e.g. a slice of rows or (y, x)
+
+        Returns
+        -------
+        z       (ndarray) float32 elevations, NaN where there is no data
         """
-        if self.NDV != None:
-            mask = np.where(self.arr == self.NDV)[0]
-            if len(mask) > 0:
-                self.arr[self.arr == self.NDV] = np.nan
+        return self.toz(self.arr[key], self.mask[key])
+
+    def readz(self, rows, cols=None):
+        """
+        Get the elevations of a window with the z transform applied, see
+        readzmask
+        """
+        return self.readzmask(rows, cols)[0]
+
+    def readzmask(self, rows, cols=None):
+        """
+        Get the elevations of a window with the z transform applied and its
+        validity mask.  If the array is loaded the stored mask is used,
+        otherwise only the window is read, see readrows, so a DTM larger
+        than memory can be worked through window by window.
+
+        Parameters
+        ----------
+        rows    (tuple) (start, stop) rows of the (cropped, sampled) image
+        cols    (tuple) (start, stop) columns, all of them by default
+
+        Returns
+        -------
+        z       (ndarray) float32 elevations, NaN where there is no data
+        mask    (ndarray) Boolean validity mask of the window
+        """
+        if cols is None:
+            cols = (0, self.size[0])
+        if self.isloaded:
+            key = (slice(*rows), slice(*cols))
+            arr, mask = self.arr[key], self.mask[key]
+        else:
+            arr, mask = self.readrows(rows, cols)
+        return self.toz(arr, mask), mask
+
+    def toz(self, arr, mask):
+        """
+        Apply the z transform to stored values, NaN where mask is False
+        """
+        z = np.multiply(arr, self.zscale, dtype=np.float32)
+        z += np.float32(self.zoffset)
+        invalid = np.logical_not(mask)
+        if np.ndim(z) == 0:
+            return np.float32(np.nan) if invalid else z
+        np.copyto(z, np.nan, where=invalid)
+        return z
+
+    def transformz(self, scale=1.0, offset=0.0):
+        """
+        Compose z' = z * scale + offset onto the z transform without
+        touching the array
+
+        Parameters
+        ----------
+        scale   (float) Multiplier
+        offset  (float) Value added after scaling
+        """
+        self.zscale *= scale
+        self.zoffset = self.zoffset * scale + offset
 
     def extractimage(self):
-        if self.crop == True:
-            pass
+        """
+        Read the (cropped) window, sampled to self.size.  Integer data stay
+        in their native type, anything else is read as float32.
+        """
+        if self.memmap:
+            raw = rawio.memmap(self.path, self.inds.RasterXSize,
+                               self.inds.RasterYSize)
+            if raw is not None:
+                self.readraw(raw)
+                return
+
+        self.arr = self.readwindow(self.band1, self.window, self.size,
+                                   getresampling(self.interpolation),
+                                   self.getreadtype(), self.threads,
+                                   self.cachemax)
+
+    def getreadtype(self):
+        """
+        NumPy data type the band is read in: integer data stay in their
+        native type, anything else is float32
+        """
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(self.band1.DataType)
+        if not np.issubdtype(dtype, np.integer):
+            dtype = np.float32
+        return dtype
+
+    def readrows(self, rows, cols=None):
+        """
+        Read a window of the (cropped, sampled) image without loading the
+        array.  Only the source pixels under the window are read, sampled
+        as by extractimage.  Neither the cache nor a raw memory map is used.
+
+        Parameters
+        ----------
+        rows    (tuple) (start, stop) rows of the image
+        cols    (tuple) (start, stop) columns, all of them by default
+
+        Returns
+        -------
+        arr     (ndarray) The window, in the type of getreadtype
+        mask    (ndarray) Boolean validity mask
+        """
+        if cols is None:
+            cols = (0, self.size[0])
+        xoff, yoff, xsize, ysize = self.window
+        xratio = xsize / float(self.size[0])
+        yratio = ysize / float(self.size[1])
+        window = [xoff + cols[0] * xratio, yoff + rows[0] * yratio,
+                  (cols[1] - cols[0]) * xratio, (rows[1] - rows[0]) * yratio]
+        if xratio == 1.0 and yratio == 1.0:
+            window = [int(v) for v in window]
+        arr = self.readwindow(self.band1, window,
+                              [cols[1] - cols[0], rows[1] - rows[0]],
+                              getresampling(self.interpolation),
+                              self.getreadtype(), self.threads, self.cachemax)
+        return arr, self.getvalidmask(arr)
+
+    def readraw(self, raw):
+        """
+        Take the window from a memory mapped raw band.  Without sampling the
+        array is a view of the file.  Nearest neighbor sampling copies just
+        the sampled pixels.  Other methods resample the view, which pages in
+        only the window.
+
+        Parameters
+        ----------
+        raw     (ndarray) Memory mapped band from rawio.memmap
+        """
+        xoff, yoff, xsize, ysize = self.window
+        view = raw[yoff:yoff + ysize, xoff:xoff + xsize]
+        if [xsize, ysize] == list(self.size):
+            self.arr = view
+            self.mapped = True
+        elif resample.getmethod(self.interpolation) == 'nearest':
+            yidx = resample.getweights(ysize, self.size[1], 'nearest')[0][:, 0]
+            xidx = resample.getweights(xsize, self.size[0], 'nearest')[0][:, 0]
+            self.arr = view[np.ix_(yidx, xidx)]
         else:
-            self.arr = self.band1.ReadAsArray().astype(np.float32)
+            self.arr = resample.resize(view, self.size, self.interpolation,
+                                       mask=self.getvalidmask(view))
+            self.mask = ~np.isnan(self.arr)
+
+    def getstrips(self, band, window, size, minpixels=2 ** 20):
+        """
+        Split a pixel window into strips of output rows whose source rows
+        follow the band's native block rows, so every block is decoded once.
+        Strips span enough block rows to hold at least minpixels source
+        pixels, which keeps the per call overhead down for one row blocks.
+
+        Parameters
+        ----------
+        band        (obj) GDAL band proxy object
+        window      (list) [xoff, yoff, xsize, ysize] in source pixels
+        size        (list) [xsize, ysize] of the output
+        minpixels   (int) Minimum number of source pixels per strip
+
+        Returns
+        -------
+        strips      (list) of (row, stop, srcrow, srcysize), the output rows
+                           and the (fractional) source rows of each strip
+        """
+        xoff, yoff, xsize, ysize = window
+        bufysize = size[1]
+        yratio = ysize / float(bufysize)
+        blockysize = band.GetBlockSize()[1]
+        blockysize *= max(1, int(math.ceil(minpixels / float(blockysize * xsize))))
+
+        strips = []
+        row = 0
+        while row < bufysize:
+            #Source row of this strip and the end of the block row it starts in
+            srcrow = yoff + row * yratio
+            blockend = (int(srcrow) // blockysize + 1) * blockysize
+            stripend = int(math.ceil((blockend - yoff) / yratio))
+            stripend = min(bufysize, max(row + 1, stripend))
+            if stripend == bufysize:
+                srcysize = yoff + ysize - srcrow
+            else:
+                srcysize = (stripend - row) * yratio
+            strips.append((row, stripend, srcrow, srcysize))
+            row = stripend
+        return strips
+
+    def readwindow(self, band, window, size, resample_alg=gdal.GRIORA_NearestNeighbour,
+                   dtype=np.float32, threads=1, cachemax=None):
+        """
+        Read a pixel window from a band in block aligned strips, see
+        getstrips, so only the blocks touched by the window are read.  When
+        size differs from the window GDAL resamples (or reads an overview)
+        during the read, so the full resolution window is never held in
+        memory.  With several threads the strips are read concurrently into
+        the output array.  GDAL handles are not thread safe, so every thread
+        opens the dataset again.
+
+        Parameters
+        ----------
+        band        (obj) GDAL band proxy object
+        window      (list) [xoff, yoff, xsize, ysize] in source pixels
+        size        (list) [xsize, ysize] of the returned array
+        resample_alg (int) GDAL GRIORA resampling constant
+        dtype       (obj) NumPy data type of the returned array
+        threads     (int) Number of reader threads
+        cachemax    (int) GDAL block cache per thread in bytes.  The GDAL
+                          cache is process wide, it is set to threads *
+                          cachemax for the read and restored afterwards.
 
-    def resize(self, percentage_reduction=0.5, interpolation='cubic'):
+        Returns
+        -------
+        arr         (ndarray) (ysize, xsize) array
+        """
+        xoff, yoff, xsize, ysize = window
+        bufxsize, bufysize = size
+        arr = np.empty((bufysize, bufxsize), dtype=dtype)
+        strips = self.getstrips(band, window, size)
+
+        def readstrip(strip, band=band):
+            row, stop, srcrow, srcysize = strip
+            band.ReadAsArray(xoff, srcrow, xsize, srcysize,
+                             bufxsize, stop - row,
+                             buf_obj=arr[row:stop],
+                             resample_alg=resample_alg)
+
+        threads = min(threads, len(strips))
+        if cachemax is not None:
+            oldcachemax = gdal.GetCacheMax()
+            gdal.SetCacheMax(cachemax * max(threads, 1))
+        try:
+            if threads <= 1:
+                for strip in strips:
+                    readstrip(strip)
+                return arr
+
+            local = threading.local()
+            handles = []
+            bandnumber = band.GetBand()
+
+            def readlocal(strip):
+                if not hasattr(local, 'band'):
+                    local.ds = gdal.Open(self.path)
+                    local.band = local.ds.GetRasterBand(bandnumber)
+                    handles.append(local.ds)
+                readstrip(strip, local.band)
+
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for _ in executor.map(readlocal, strips):
+                    pass
+            del handles[:]
+        finally:
+            if cachemax is not None:
+                gdal.SetCacheMax(oldcachemax)
+        return arr
+
+    def resize(self, percentage_reduction=0.5, interpolation='cubic',
+               workers=None, memory=256 * 1024 ** 2):
         """
         Resize the array by a given percentage using the provided interpolation
-        method.
+        method.  No data pixels do not bleed into their neighbors and the
+        resized array is float32 with NaN as the no data value.
 
         Parameters
         -----------
         percentage_reduction    (float) The percentage to reduce the image by.
         interpolateion          (str) Interpolation method
-            Valid Arguments: nearest, bilinear, bicubic, cubic
+            Valid Arguments: nearest, area, linear, bilinear, bicubic, cubic,
+                             lanczos
+        workers                 (int) Number of resampling threads
+        memory                  (int) Working memory ceiling in bytes
         """
-        self.arr = imresize(self.arr, percentage_reduction,
-                            interp=interpolation.lower(),mode='F')
+        ysize, xsize = self.arr.shape
+        size = [max(1, int(xsize * percentage_reduction)),
+                max(1, int(ysize * percentage_reduction))]
+        self.arr = resample.resize(self.arr, size, interpolation,
+                                   mask=self.mask, workers=workers,
+                                   memory=memory)
+        self.mask = ~np.isnan(self.arr)
+        self.scalegeotransform(xsize / float(self.arr.shape[1]),
+                               ysize / float(self.arr.shape[0]))
+        self.size = [self.arr.shape[1], self.arr.shape[0]]
 
     def scale(self, zscale):
         """
-        Scale the DTM z value by some amount
+        Scale the DTM z value by some amount.  The scale is applied lazily
+        by getz.
 
         Parameters
         ----------
         scale       (float) Values to scale by
         """
-        self.arr *= zscale
+        self.transformz(zscale)
 
     def pixel2latlon(self, x, y):
         """
@@ -200,6 +775,28 @@ class ReadGDAL():
         yp = wf['rotationy'] * x + wf['ypixelsize'] * y + wf['toplefty']
         return xp,yp
 
+    def latlon2pixel(self, xp, yp):
+        """
+        The inverse of pixel2latlon, from lat,long to (fractional) pixel space
+
+        Parameters
+        ----------
+        xp      (float) longitude
+        yp      (float) latitude
+
+        Return
+        -------
+        x       (float) x pixel value
+        y       (float) y pixel value
+        """
+        wf = self.worldfile
+        det = wf['xpixelsize'] * wf['ypixelsize'] - wf['rotationx'] * wf['rotationy']
+        dx = xp - wf['topleftx']
+        dy = yp - wf['toplefty']
+        x = (wf['ypixelsize'] * dx - wf['rotationx'] * dy) / det
+        y = (wf['xpixelsize'] * dy - wf['rotationy'] * dx) / det
+        return x, y
+
     def geocorners(self):
         """
         Get the corner of the georeferenced image in lat/long
@@ -235,3 +832,23 @@ class ReadGDAL():
                 self.minlat = e[1]
             if e[1] > self.maxlat:
                 self.maxlat = e[1]
+
+
+def getresampling(interpolation):
+    """
+    Map an interpolation name onto a GDAL resampling constant
+
+    Parameters
+    ----------
+    interpolation   (str) Interpolation method, case insensitive
+
+    Returns
+    -------
+    alg             (int) GDAL GRIORA resampling constant
+    """
+    if interpolation is None:
+        interpolation = 'cubic'
+    try:
+        return RESAMPLING[interpolation.lower()]
+    except KeyError:
+        raise ValueError("Unknown interpolation method", interpolation)
@@ -33,203 +33,459 @@ from osgeo import gdal, gdal_array
 from osgeo.gdalconst import *
 import numpy
 import sys
+from collections import deque
+from multiprocessing import Pool
 
 # =============================================================================
-# rgb_to_hsv()
+# frontview()
 #
-# rgb comes in as [r,g,b] with values in the range [0,255].  The returned
-# hsv values will be with hue and saturation in the range [0,1] and value
-# in the range [0,255]
+# A contiguous view of the front of a buffer, so one buffer sized for the
+# largest block serves every (smaller) block.
+
+def frontview( buf, shape ):
+
+    size = int(numpy.prod(shape))
+    return buf.reshape(-1)[:size].reshape(shape)
+
+# =============================================================================
+# Workspace
 #
-def rgb_to_hsv( r,g,b ):
+# float32 buffers used by rgb_to_hsv and hsv_to_rgb: the hsv planes and
+# three scratch planes.  Allocate one per merge (or worker) and pass it to
+# the kernels for every block, it grows when a larger block comes along.
 
-    maxc = numpy.maximum(r,numpy.maximum(g,b))
-    minc = numpy.minimum(r,numpy.minimum(g,b))
+class Workspace(object):
 
-    v = maxc
+    def __init__( self, shape=(0,) ):
+        self.size = 0
+        self.grow( int(numpy.prod(shape)) )
 
-    minc_eq_maxc = numpy.equal(minc,maxc)
+    def grow( self, size ):
+        self.size = size
+        self.hsv = numpy.empty(3 * size, dtype=numpy.float32)
+        self.tmp = numpy.empty(3 * size, dtype=numpy.float32)
 
-    # compute the difference, but reset zeros to ones to avoid divide by zeros later.
-    ones = numpy.ones((r.shape[0],r.shape[1]))
-    maxc_minus_minc = numpy.choose( minc_eq_maxc, (maxc-minc,ones) )
+    def view( self, shape ):
+        shape = tuple(shape)
+        if int(numpy.prod(shape)) > self.size:
+            self.grow( int(numpy.prod(shape)) )
+        return (frontview(self.hsv, (3,) + shape),
+                frontview(self.tmp, (3,) + shape))
 
-    s = (maxc-minc) / numpy.maximum(ones,maxc)
-    rc = (maxc-r) / maxc_minus_minc
-    gc = (maxc-g) / maxc_minus_minc
-    bc = (maxc-b) / maxc_minus_minc
+# =============================================================================
+# select()
+#
+# a = b where mask else a, for a 0/1 float mask.  Unlike copyto(where=) this
+# runs on the fast unmasked loops and, multiplying by exactly 0 or 1, gives
+# exactly a or b.  b and mask are overwritten.
 
-    maxc_is_r = numpy.equal(maxc,r)
-    maxc_is_g = numpy.equal(maxc,g)
-    maxc_is_b = numpy.equal(maxc,b)
+def select( a, b, mask ):
 
-    h = numpy.zeros((r.shape[0],r.shape[1]))
-    h = numpy.choose( maxc_is_b, (h,4.0+gc-rc) )
-    h = numpy.choose( maxc_is_g, (h,2.0+rc-bc) )
-    h = numpy.choose( maxc_is_r, (h,bc-gc) )
+    b *= mask
+    numpy.subtract(1.0, mask, out=mask)
+    a *= mask
+    a += b
+    return a
 
-    h = numpy.mod(h/6.0,1.0)
+# =============================================================================
+# rgb_to_hsv()
+#
+# rgb comes in as [r,g,b] uint8 arrays with values in the range [0,255].  The
+# returned float32 (3, ...) hsv array has hue and saturation in the range
+# [0,1] and value in the range [0,255].  It is a view into the workspace, so
+# it is only valid until the workspace is used again.
+#
+# When the max is shared the hue follows r, then g, then b.  Written as
+# (g-b), (b-r) and (r-g) over max-min this is the same hue as the classic
+# formulation without the rc, gc and bc planes.
+
+def rgb_to_hsv( r,g,b, work=None ):
+
+    if work is None:
+        work = Workspace(r.shape)
+    hsv, tmp = work.view(r.shape)
+    h, s, v = hsv
+    other, delta, mask = tmp
+
+    #v is the max, delta the max - min
+    numpy.maximum(r, g, out=v, dtype=numpy.float32)
+    numpy.maximum(v, b, out=v)
+    numpy.minimum(r, g, out=delta, dtype=numpy.float32)
+    numpy.minimum(delta, b, out=delta)
+    numpy.subtract(v, delta, out=delta)
+
+    numpy.maximum(v, 1.0, out=s)
+    numpy.divide(delta, s, out=s)
+
+    #max - min is integral, reset zeros to ones to avoid divide by zeros
+    numpy.maximum(delta, 1.0, out=delta)
+
+    #b is the max
+    numpy.subtract(r, g, out=h, dtype=numpy.float32)
+    h /= delta
+    h += 4.0
+
+    #g is the max
+    numpy.subtract(b, r, out=other, dtype=numpy.float32)
+    other /= delta
+    other += 2.0
+    numpy.equal(v, g, out=mask)
+    select(h, other, mask)
+
+    #r is the max
+    numpy.subtract(g, b, out=other, dtype=numpy.float32)
+    other /= delta
+    numpy.equal(v, r, out=mask)
+    select(h, other, mask)
+
+    #h is in [-1, 5), wrap the negative hues and scale to [0, 1)
+    numpy.less(h, 0.0, out=mask)
+    mask *= 6.0
+    h += mask
+    h /= 6.0
 
-    hsv = numpy.asarray([h,s,v])
-    
     return hsv
 
 # =============================================================================
 # hsv_to_rgb()
 #
-# hsv comes in as [h,s,v] with hue and saturation in the range [0,1],
-# but value in the range [0,255].
+# hsv comes in as a float32 [h,s,v] array with hue and saturation in the
+# range [0,1], but value in the range [0,255].  hsv is overwritten.  The
+# result is written to out, a (3, ...) uint8 array.
+#
+# Each channel is v - v*s*f with f the piecewise linear share of the hue
+# that channel loses, e.g. clip(2 - |6h - 3|, 0, 1) for r.  This matches the
+# six sector (p, q, t) formulation without the sector index and the choose
+# temporaries.
+
+def hsv_to_rgb( hsv, out=None, work=None ):
+
+    if work is None:
+        work = Workspace(hsv.shape[1:])
+    if out is None:
+        out = numpy.empty(hsv.shape, dtype=numpy.uint8)
+    tmp = work.view(hsv.shape[1:])[1]
+    h, s, v = hsv
+    f = tmp[0]
+
+    h *= 6.0
+    s *= v
+    #r loses clip(2 - |6h - 3|, 0, 1), g and b clip(|6h - c| - 1, 0, 1)
+    #with c = 2 and 4
+    for center, channel in zip((3.0, 2.0, 4.0), out):
+        numpy.subtract(h, center, out=f)
+        numpy.absolute(f, out=f)
+        if center == 3.0:
+            numpy.subtract(2.0, f, out=f)
+        else:
+            f -= 1.0
+        numpy.maximum(f, 0.0, out=f)
+        numpy.minimum(f, 1.0, out=f)
+        f *= s
+        numpy.subtract(v, f, out=f)
+        numpy.copyto(channel, f, casting='unsafe')
+
+    return out
+
+# =============================================================================
+# opendataset()
+#
+# Accept a dataset, a path or an array ((bands, rows, cols) for color,
+# (rows, cols) for the hillshade), the latter wrapped in a MEM dataset.
+
+def opendataset( src ):
+
+    if isinstance(src, gdal.Dataset):
+        return src
+    if isinstance(src, numpy.ndarray):
+        return gdal_array.OpenArray(src)
+    ds = gdal.Open( src, GA_ReadOnly )
+    if ds is None:
+        raise IOError('Unable to open ' + str(src))
+    return ds
+
+# =============================================================================
+# getpath()
+#
+# The file behind a dataset or path that another process can open, None for
+# arrays, in memory datasets and /vsimem/ files.
 
-def hsv_to_rgb( hsv ):
+def getpath( src ):
 
-    h = hsv[0]
-    s = hsv[1]
-    v = hsv[2]
+    if isinstance(src, numpy.ndarray):
+        return None
+    if isinstance(src, gdal.Dataset):
+        if src.GetDriver().ShortName == 'MEM':
+            return None
+        src = src.GetDescription()
+    if src.startswith('/vsimem/'):
+        return None
+    return src
 
-    #if s == 0.0: return v, v, v
-    i = (h*6.0).astype(int)
-    f = (h*6.0) - i
-    p = v*(1.0 - s)
-    q = v*(1.0 - s*f)
-    t = v*(1.0 - s*(1.0-f))
+# =============================================================================
+# getwindows()
+#
+# Windows aligned to the block size of band, about pixels pixels each, as
+# (xoff, yoff, xsize, ysize) in row major order.
 
-    r = i.choose( v, q, p, p, t, v )
-    g = i.choose( t, v, v, q, p, p )
-    b = i.choose( p, p, t, v, v, q )
+def getwindows( band, pixels=2 ** 20 ):
 
-    rgb = numpy.asarray([r,g,b]).astype(numpy.uint8)
-    
-    return rgb
+    xsize = band.XSize
+    ysize = band.YSize
+    blockxsize, blockysize = band.GetBlockSize()
+    if blockxsize >= xsize:
+        winxsize = xsize
+    else:
+        winxsize = min(xsize, blockxsize * max(1, int(pixels ** 0.5) // blockxsize))
+    winysize = min(ysize, blockysize * max(1, pixels // (winxsize * blockysize)))
+    return [(x, y, min(winxsize, xsize - x), min(winysize, ysize - y))
+            for y in range(0, ysize, winysize)
+            for x in range(0, xsize, winxsize)]
+
+# =============================================================================
+# mergeblock()
+#
+# Merge one window: color is (bands, rows, cols) uint8, hill (rows, cols)
+# and out a (bands, rows, cols) uint8 buffer.  Alpha is passed through.
+
+def mergeblock( color, hill, hillbandnodatavalue, out, work=None ):
+
+    if work is None:
+        work = Workspace(hill.shape)
+
+    #convert to HSV
+    hsv = rgb_to_hsv( color[0], color[1], color[2], work )
+
+    #replace v with hillshade, but if there's nodata on the hillband keep
+    #the v value from the color dataset
+    if hillbandnodatavalue is not None:
+        other, mask = work.view(hill.shape)[1][:2]
+        numpy.copyto(other, hill, casting='unsafe')
+        numpy.not_equal(hill, hillbandnodatavalue, out=mask)
+        select(hsv[2], other, mask)
+    else:
+        numpy.copyto(hsv[2], hill, casting='unsafe')
+
+    #convert back to RGB
+    hsv_to_rgb( hsv, out[:3], work )
+    if color.shape[0] == 4:
+        out[3] = color[3]
+    return out
+
+# =============================================================================
+# Worker processes of a parallel merge, each holding its own handles
+
+_worker = {}
+
+def _initworker( color_path, hill_path ):
+
+    _worker['color'] = gdal.Open( color_path, GA_ReadOnly )
+    _worker['hill'] = gdal.Open( hill_path, GA_ReadOnly )
+    _worker['work'] = Workspace()
+
+def _mergeworker( window ):
+
+    x, y, w, h = window
+    colordataset = _worker['color']
+    color = numpy.empty((colordataset.RasterCount, h, w), dtype=numpy.uint8)
+    colordataset.ReadAsArray(x, y, w, h, buf_obj=color)
+    hillband = _worker['hill'].GetRasterBand(1)
+    hill = hillband.ReadAsArray(x, y, w, h)
+    out = numpy.empty(color.shape, dtype=numpy.uint8)
+    return mergeblock( color, hill, hillband.GetNoDataValue(), out,
+                       _worker['work'] )
+
+# =============================================================================
+# merge()
+#
+# Use the hillshade as the intensity (HSV value) of the color relief.
+# color and hill are datasets, paths or arrays.  The result is written to
+# out_path with the format driver and the output dataset is returned, so a
+# MEM or /vsimem/ output can be used in process.
+#
+# callback is a GDAL style progress callback, (complete, message, data),
+# called after every window in place of the quiet terminal progress.
+#
+# With jobs > 1 the windows are merged by a pool of worker processes that
+# open the inputs themselves and hand the merged windows back to this
+# process, the only writer.  The output is identical to the serial merge.
+# Arrays and in memory datasets can not be shared and are merged serially.
+
+def merge( color, hill, out_path, format='GTiff', quiet=True, jobs=1, callback=None ):
+
+    datatype = GDT_Byte
+
+    hilldataset = opendataset( hill )
+    colordataset = opendataset( color )
+
+    #check for 3 or 4 bands in the color file
+    bandcount = colordataset.RasterCount
+    if (bandcount != 3 and bandcount != 4):
+        raise ValueError('Source image does not appear to have three or four bands as required.')
+
+    #assign hillshade band
+    hillband = hilldataset.GetRasterBand(1)
+    hillbandnodatavalue = hillband.GetNoDataValue()
+    xsize = hillband.XSize
+    ysize = hillband.YSize
+
+    #check for same file size
+    if ((colordataset.RasterXSize != xsize) or (colordataset.RasterYSize != ysize)):
+        raise ValueError('Color and hilshade must be the same size in pixels.')
+
+    #define output format, name, size, type and set projection
+    out_driver = gdal.GetDriverByName(format)
+    outdataset = out_driver.Create(out_path, xsize, ysize, bandcount, datatype)
+    outdataset.SetProjection(hilldataset.GetProjection())
+    outdataset.SetGeoTransform(hilldataset.GetGeoTransform())
+
+    #process windows aligned to the color blocks
+    windows = getwindows( colordataset.GetRasterBand(1) )
+    winxsize = max(w for x, y, w, h in windows)
+    winysize = max(h for x, y, w, h in windows)
+
+    band_list = list(range(1, bandcount + 1))
+
+    def progress( n ):
+        if callback is not None:
+            callback( float(n+1) / len(windows), '', None )
+        elif not quiet:
+            gdal.TermProgress_nocb( (float(n+1) / len(windows)) )
+
+    color_path = getpath( color )
+    hill_path = getpath( hill )
+    if jobs > 1 and len(windows) > 1 and color_path is not None and hill_path is not None:
+        #multiprocessing.Pool rather than ProcessPoolExecutor, whose
+        #initializer needs Python 3.7
+        pool = Pool(processes=jobs, initializer=_initworker,
+                    initargs=(color_path, hill_path))
+        try:
+            #keep a few windows per worker in flight, so finished windows do
+            #not pile up in memory while the writer catches up
+            pending = deque()
+            queued = iter(windows)
+            for window in queued:
+                pending.append((window, pool.apply_async(_mergeworker, (window,))))
+                if len(pending) >= 2 * jobs:
+                    break
+            n = 0
+            while pending:
+                (x, y, w, h), result = pending.popleft()
+                outdataset.WriteRaster(x, y, w, h, result.get(),
+                                       buf_type=datatype, band_list=band_list)
+                progress( n )
+                n += 1
+                for window in queued:
+                    pending.append((window, pool.apply_async(_mergeworker, (window,))))
+                    break
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        outdataset.FlushCache()
+        return outdataset
+
+    #buffers reused by every window
+    hilltype = gdal_array.GDALTypeCodeToNumericTypeCode(hillband.DataType)
+    colorbuf = numpy.empty((bandcount, winysize, winxsize), dtype=numpy.uint8)
+    hillbuf = numpy.empty((winysize, winxsize), dtype=hilltype)
+    outbuf = numpy.empty((bandcount, winysize, winxsize), dtype=numpy.uint8)
+    work = Workspace((winysize, winxsize))
+
+    for n, (x, y, w, h) in enumerate(windows):
+        #load all color bands and the hillshade of the window at once, into
+        #contiguous views of the front of the buffers
+        color = frontview(colorbuf, (bandcount, h, w))
+        hill = frontview(hillbuf, (h, w))
+        colordataset.ReadAsArray(x, y, w, h, buf_obj=color)
+        hillband.ReadAsArray(x, y, w, h, buf_obj=hill)
+
+        out = frontview(outbuf, (bandcount, h, w))
+        mergeblock( color, hill, hillbandnodatavalue, out, work )
+
+        #write out all of the bands of the window at once
+        outdataset.WriteRaster(x, y, w, h, out, buf_type=datatype,
+                               band_list=band_list)
+
+        #update progress line
+        progress( n )
+
+    outdataset.FlushCache()
+    return outdataset
 
 # =============================================================================
 # Usage()
 
 def Usage():
-    print("""Usage: hsv_merge.py [-q] [-of format] src_color src_greyscale dst_color
+    print("""Usage: hsv_merge.py [-q] [-of format] [-j jobs] src_color src_greyscale dst_color
 
 where src_color is a RGB or RGBA dataset,
       src_greyscale is a greyscale dataset (e.g. the result of gdaldem hillshade)
       dst_color will be a RGB or RGBA dataset using the greyscale as the
       intensity for the color dataset.
+      jobs is the number of worker processes (default 1).
 """)
-    sys.exit(1)
-    
-# =============================================================================
-# 	Mainline
+    return 1
+
 # =============================================================================
+# main()
 
-argv = gdal.GeneralCmdLineProcessor( sys.argv )
-if argv is None:
-    sys.exit( 0 )
+def main( argv ):
 
-format = 'GTiff'
-src_color_filename = None
-src_greyscale_filename = None
-dst_color_filename = None
-quiet = False
+    argv = gdal.GeneralCmdLineProcessor( argv )
+    if argv is None:
+        return 0
 
-# Parse command line arguments.
-i = 1
-while i < len(argv):
-    arg = argv[i]
+    format = 'GTiff'
+    src_color_filename = None
+    src_greyscale_filename = None
+    dst_color_filename = None
+    quiet = False
+    jobs = 1
 
-    if arg == '-of':
-        i = i + 1
-        format = argv[i]
+    # Parse command line arguments.
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
 
-    elif arg == '-q' or arg == '-quiet':
-        quiet = True
+        if arg == '-of':
+            i = i + 1
+            format = argv[i]
 
-    elif src_color_filename is None:
-        src_color_filename = argv[i]
+        elif arg == '-q' or arg == '-quiet':
+            quiet = True
 
-    elif src_greyscale_filename is None:
-        src_greyscale_filename = argv[i]
+        elif arg == '-j':
+            i = i + 1
+            jobs = int(argv[i])
 
-    elif dst_color_filename is None:
-        dst_color_filename = argv[i]
-    else:
-        Usage()
-
-    i = i + 1
-
-if dst_color_filename is None:
-    Usage()
-
-datatype = GDT_Byte
-
-hilldataset = gdal.Open( src_greyscale_filename, GA_ReadOnly )
-colordataset = gdal.Open( src_color_filename, GA_ReadOnly )
-
-#check for 3 or 4 bands in the color file
-if (colordataset.RasterCount != 3 and colordataset.RasterCount != 4):
-    print('Source image does not appear to have three or four bands as required.')
-    sys.exit(1)
-
-#define output format, name, size, type and set projection
-out_driver = gdal.GetDriverByName(format)
-outdataset = out_driver.Create(dst_color_filename, colordataset.RasterXSize, \
-                   colordataset.RasterYSize, colordataset.RasterCount, datatype)
-outdataset.SetProjection(hilldataset.GetProjection())
-outdataset.SetGeoTransform(hilldataset.GetGeoTransform())
-
-#assign RGB and hillshade bands
-rBand = colordataset.GetRasterBand(1)
-gBand = colordataset.GetRasterBand(2)
-bBand = colordataset.GetRasterBand(3)
-if colordataset.RasterCount == 4:
-    aBand = colordataset.GetRasterBand(4)
-else:
-    aBand = None
-
-hillband = hilldataset.GetRasterBand(1)
-hillbandnodatavalue = hillband.GetNoDataValue()
-
-#check for same file size
-if ((rBand.YSize != hillband.YSize) or (rBand.XSize != hillband.XSize)):
-    print('Color and hilshade must be the same size in pixels.')
-    sys.exit(1)
-
-#loop over lines to apply hillshade
-for i in range(hillband.YSize):
-    #load RGB and Hillshade arrays
-    rScanline = rBand.ReadAsArray(0, i, hillband.XSize, 1, hillband.XSize, 1)
-    gScanline = gBand.ReadAsArray(0, i, hillband.XSize, 1, hillband.XSize, 1)
-    bScanline = bBand.ReadAsArray(0, i, hillband.XSize, 1, hillband.XSize, 1)
-    hillScanline = hillband.ReadAsArray(0, i, hillband.XSize, 1, hillband.XSize, 1)
+        elif src_color_filename is None:
+            src_color_filename = argv[i]
 
-    #convert to HSV
-    hsv = rgb_to_hsv( rScanline, gScanline, bScanline )
+        elif src_greyscale_filename is None:
+            src_greyscale_filename = argv[i]
 
-    # if there's nodata on the hillband, use the v value from the color
-    # dataset instead of the hillshade value.
-    if hillbandnodatavalue is not None:
-        equal_to_nodata = numpy.equal(hillScanline, hillbandnodatavalue)
-        v = numpy.choose(equal_to_nodata,(hillScanline,hsv[2]))
-    else:
-        v = hillScanline
+        elif dst_color_filename is None:
+            dst_color_filename = argv[i]
+        else:
+            return Usage()
 
-    #replace v with hillshade
-    hsv_adjusted = numpy.asarray( [hsv[0], hsv[1], v] )
+        i = i + 1
 
-    #convert back to RGB
-    dst_color = hsv_to_rgb( hsv_adjusted )
-
-    #write out new RGB bands to output one band at a time
-    outband = outdataset.GetRasterBand(1)
-    outband.WriteArray(dst_color[0], 0, i)
-    outband = outdataset.GetRasterBand(2)
-    outband.WriteArray(dst_color[1], 0, i)
-    outband = outdataset.GetRasterBand(3)
-    outband.WriteArray(dst_color[2], 0, i)
-    if aBand is not None:
-        aScanline = aBand.ReadAsArray(0, i, hillband.XSize, 1, hillband.XSize, 1)
-        outband = outdataset.GetRasterBand(4)
-        outband.WriteArray(aScanline, 0, i)
-
-    #update progress line
-    if not quiet:
-        gdal.TermProgress_nocb( (float(i+1) / hillband.YSize) )
-
-#formal exit
-sys.exit(0)
+    if dst_color_filename is None:
+        return Usage()
+
+    try:
+        merge( src_color_filename, src_greyscale_filename,
+               dst_color_filename, format=format, quiet=quiet, jobs=jobs )
+    except (IOError, ValueError) as e:
+        print(e)
+        return 1
+    return 0
+
+# =============================================================================
+# 	Mainline
+# =============================================================================
+
+if __name__ == '__main__':
+    sys.exit( main( sys.argv ) )
@@ -0,0 +1,102 @@
+"""
+Per job working directories.
+
+Every pipeline run writes its intermediates and products into a private
+scratch directory and publishes the finished products into the output
+directory by renaming them, so concurrent jobs sharing an output directory
+never see (or clobber) each other's partial files.
+"""
+import errno
+import os
+import shutil
+import tempfile
+
+
+class JobDirectory(object):
+    def __init__(self, output_dir=None, scratch_root=None, keep=False):
+        """
+        Parameters
+        ----------
+        output_dir      (str) PATH products are published to, the current
+                              working directory by default
+        scratch_root    (str) PATH the scratch directory is created in,
+                              output_dir by default so publishing is a rename
+        keep            (bool) Keep the scratch directory on cleanup
+
+        Attributes
+        ----------
+        scratch_dir     (str) PATH of this job's scratch directory
+        """
+        if output_dir is None:
+            output_dir = os.getcwd()
+        self.output_dir = os.path.abspath(output_dir)
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.scratch_dir = tempfile.mkdtemp(prefix='.spaceblender-',
+                                            dir=scratch_root or self.output_dir)
+        self.keep = keep
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def scratch(self, name):
+        """
+        PATH of name in the scratch directory
+        """
+        return os.path.join(self.scratch_dir, name)
+
+    def output(self, name):
+        """
+        PATH name is published to
+        """
+        return os.path.join(self.output_dir, name)
+
+    def publish(self, name, final_name=None):
+        """
+        Atomically move a finished product from the scratch directory into
+        the output directory, replacing an older product of the same name
+
+        Parameters
+        ----------
+        name        (str) Name of the product in the scratch directory
+        final_name  (str) Name in the output directory, name by default
+
+        Returns
+        -------
+        path        (str) PATH of the published product
+        """
+        src = self.scratch(name)
+        dst = self.output(final_name or name)
+        try:
+            os.replace(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            #The scratch directory is on another file system, copy next to
+            #the destination first so the final step is still a rename
+            tmp = '{}.tmp-{}'.format(dst, os.getpid())
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+            os.remove(src)
+        return dst
+
+    def publish_all(self):
+        """
+        Publish every file in the scratch directory
+
+        Returns
+        -------
+        paths       (list) PATHs of the published products
+        """
+        return [self.publish(name) for name in sorted(os.listdir(self.scratch_dir))
+                if os.path.isfile(self.scratch(name))]
+
+    def cleanup(self):
+        """
+        Remove the scratch directory and whatever was not published
+        """
+        if not self.keep:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
@@ -0,0 +1,121 @@
+"""
+Progress reporting.
+
+Long running stages (texture, merge) report the fraction done to a
+Progress hub, which hands every event to its subscribers: the console, the
+Blender window manager, a queue read by a job runner.  In process GDAL work
+reports through GDAL's own progress callbacks, so nothing polls.
+"""
+import sys
+import threading
+
+
+class Event(object):
+    def __init__(self, stage, fraction, message=None):
+        """
+        Parameters
+        ----------
+        stage       (str) Name of the stage, e.g. 'texture'
+        fraction    (float) Fraction done in [0, 1]
+        message     (str) Optional text, e.g. an error or 'done'
+        """
+        self.stage = stage
+        self.fraction = fraction
+        self.message = message
+
+    def __repr__(self):
+        return 'Event({!r}, {:.3f}, {!r})'.format(self.stage, self.fraction,
+                                                 self.message)
+
+
+class Progress(object):
+    def __init__(self, subscribers=()):
+        """
+        A hub that stages report to and consumers subscribe to.  Reports may
+        come from several threads, subscribers are called one event at a
+        time.
+
+        Parameters
+        ----------
+        subscribers (iterable) Callables taking an Event
+        """
+        self.subscribers = list(subscribers)
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscriber):
+        """
+        Add a callable taking an Event, returns it so it can be unsubscribed
+        """
+        with self._lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.remove(subscriber)
+
+    def report(self, stage, fraction, message=None):
+        event = Event(stage, min(max(float(fraction), 0.0), 1.0), message)
+        with self._lock:
+            for subscriber in self.subscribers:
+                subscriber(event)
+
+    def callback(self, stage):
+        """
+        A GDAL progress callback reporting to stage
+
+        Returns
+        -------
+        callback    (callable) (complete, message, data) -> 1, usable as the
+                               callback of hsv_merge.merge and texture.build
+        """
+        def callback(complete, message=None, data=None):
+            self.report(stage, complete, message or None)
+            return 1
+        return callback
+
+
+class ConsoleSubscriber(object):
+    def __init__(self, stream=None, step=0.1):
+        """
+        Print a line per stage every step of progress
+
+        Parameters
+        ----------
+        stream      (obj) File to write to, sys.stdout by default
+        step        (float) Fraction between printed lines
+        """
+        self.stream = stream
+        self.step = step
+        self.last = {}
+
+    def __call__(self, event):
+        #Print on the first event of each step, and every message
+        bucket = int(event.fraction / self.step + 1e-9)
+        if event.message is None and bucket <= self.last.get(event.stage, -1):
+            return
+        self.last[event.stage] = bucket
+        stream = self.stream or sys.stdout
+        line = '{}: {:3d}%'.format(event.stage, int(round(event.fraction * 100)))
+        if event.message:
+            line += ' - ' + event.message
+        stream.write(line + '\n')
+        stream.flush()
+        #A finished stage may run again
+        if event.fraction >= 1.0:
+            del self.last[event.stage]
+
+
+def queue_subscriber(queue):
+    """
+    A subscriber putting every Event on a queue.Queue, for a consumer on
+    another thread such as a job runner
+    """
+    return queue.put
+
+
+def console():
+    """
+    A Progress printing to stdout, the default of the command line tools
+    """
+    return Progress([ConsoleSubscriber()])
@@ -0,0 +1,289 @@
+"""
+Zero copy access to uncompressed PDS3 .IMG and ISIS3 .cub rasters.
+
+For these formats the pixels are a plain binary block at an offset given in
+the (PVL) label.  Rather than copying them through the GDAL block cache the
+block is exposed as a read only, copy on write np.memmap, so cropping,
+decimation and statistics only page in what they touch.  Anything that is
+not a simple raw layout (compressed, tiled ISIS cubes, band interleaved
+multi-band images) is left to GDAL.
+"""
+import os
+
+import numpy as np
+
+#PDS3 SAMPLE_TYPE to NumPy byte order and kind
+PDS_SAMPLE_TYPES = {'MSB_INTEGER': '>i', 'SUN_INTEGER': '>i',
+                    'MAC_INTEGER': '>i', 'INTEGER': '>i',
+                    'LSB_INTEGER': '<i', 'PC_INTEGER': '<i',
+                    'VAX_INTEGER': '<i',
+                    'MSB_UNSIGNED_INTEGER': '>u', 'SUN_UNSIGNED_INTEGER': '>u',
+                    'MAC_UNSIGNED_INTEGER': '>u', 'UNSIGNED_INTEGER': '>u',
+                    'LSB_UNSIGNED_INTEGER': '<u', 'PC_UNSIGNED_INTEGER': '<u',
+                    'VAX_UNSIGNED_INTEGER': '<u',
+                    'IEEE_REAL': '>f', 'SUN_REAL': '>f', 'MAC_REAL': '>f',
+                    'FLOAT': '>f', 'REAL': '>f', 'PC_REAL': '<f'}
+
+#ISIS3 Pixels Type to NumPy kind and size
+ISIS_PIXEL_TYPES = {'UNSIGNEDBYTE': 'u1', 'SIGNEDBYTE': 'i1',
+                    'UNSIGNEDWORD': 'u2', 'SIGNEDWORD': 'i2',
+                    'UNSIGNEDINTEGER': 'u4', 'SIGNEDINTEGER': 'i4',
+                    'REAL': 'f4', 'DOUBLE': 'f8'}
+
+ISIS_BYTE_ORDERS = {'LSB': '<', 'MSB': '>'}
+
+
+def readlabel(path, chunk=65536, maxsize=2 ** 22):
+    """
+    Read the text of an attached PVL label, up to its END statement
+
+    Parameters
+    ----------
+    path        (str) PATH to the image or detached label
+    chunk       (int) Number of bytes read at a time
+    maxsize     (int) Give up after this many bytes
+
+    Returns
+    -------
+    lines       (list) Label lines, or None if the file has no PVL label
+    """
+    with open(path, 'rb') as f:
+        head = f.read(chunk)
+        start = head.lstrip()[:32].upper()
+        if not (start.startswith(b'PDS_VERSION_ID') or
+                start.startswith(b'ODL_VERSION_ID') or
+                start.startswith(b'OBJECT') or
+                start.startswith(b'CCSD')):
+            return None
+        text = head
+        while True:
+            lines = text.decode('ascii', 'replace').splitlines()
+            for i, line in enumerate(lines):
+                if line.strip().upper() == 'END':
+                    return lines[:i]
+            if len(text) >= maxsize:
+                return None
+            more = f.read(chunk)
+            if not more:
+                return lines
+            text += more
+
+
+def parselabel(lines):
+    """
+    Parse PVL lines into nested dicts.  Keys are upper cased, OBJECT and GROUP
+    blocks become dicts keyed by their name, values are left as strings with
+    quotes and units removed.
+
+    Parameters
+    ----------
+    lines       (list) Label lines from readlabel
+
+    Returns
+    -------
+    label       (dict) The parsed label
+    """
+    label = {}
+    stack = [label]
+    pending = None
+    for line in lines:
+        if pending is not None:
+            key, value = pending
+            value += ' ' + line.strip()
+            if _closed(value):
+                stack[-1][key] = _value(key, value)
+                pending = None
+            else:
+                pending = (key, value)
+            continue
+
+        line = line.split('/*')[0].strip()
+        if '=' in line:
+            key, value = [part.strip() for part in line.split('=', 1)]
+        else:
+            #ISIS closes blocks with a bare End_Group / End_Object
+            key, value = line, ''
+        key = key.upper()
+
+        if key in ('OBJECT', 'GROUP'):
+            block = {}
+            stack[-1][_clean(value).upper()] = block
+            stack.append(block)
+        elif key in ('END_OBJECT', 'END_GROUP'):
+            if len(stack) > 1:
+                stack.pop()
+        elif not value:
+            continue
+        elif _closed(value):
+            stack[-1][key] = _value(key, value)
+        else:
+            pending = (key, value)
+    return label
+
+
+def _closed(value):
+    return value.count('"') % 2 == 0 and value.count('(') <= value.count(')')
+
+
+def _value(key, value):
+    #Pointers keep their <BYTES> unit, it changes how the offset is counted
+    if key.startswith('^'):
+        return value.strip()
+    return _clean(value)
+
+
+def _clean(value):
+    value = value.strip()
+    if value.endswith('>') and '<' in value:
+        value = value[:value.rindex('<')].strip()
+    return value.strip('"').strip()
+
+
+def pdslayout(label, path):
+    """
+    Get the raw layout of the first band of a PDS3 IMAGE object
+
+    Parameters
+    ----------
+    label       (dict) Parsed label
+    path        (str) PATH to the file holding the label
+
+    Returns
+    -------
+    layout      (dict) Keys: path, offset, dtype, lines, samples, prefix,
+                       suffix or None if the image is not raw
+    """
+    image = label.get('IMAGE')
+    pointer = label.get('^IMAGE')
+    if image is None or pointer is None or 'ENCODING_TYPE' in image:
+        return None
+
+    recordbytes = int(label.get('RECORD_BYTES', 1))
+    datapath = path
+    pointer = pointer.strip('()').replace('"', '')
+    parts = [p.strip() for p in pointer.split(',')]
+    if len(parts) == 2:
+        #Detached, ("FILE.IMG", 5) or ("FILE.IMG", 1024 <BYTES>)
+        datapath = os.path.join(os.path.dirname(path), parts[0])
+        pointer = parts[1]
+    elif not parts[0].upper().replace('<BYTES>', '').strip().isdigit():
+        datapath = os.path.join(os.path.dirname(path), parts[0])
+        pointer = '1'
+    if '<BYTES>' in pointer.upper():
+        offset = int(pointer.upper().replace('<BYTES>', '').strip()) - 1
+    else:
+        offset = (int(pointer) - 1) * recordbytes
+
+    bands = int(image.get('BANDS', 1))
+    if bands > 1 and image.get('BAND_STORAGE_TYPE', 'BAND_SEQUENTIAL').upper() != 'BAND_SEQUENTIAL':
+        return None
+
+    bits = int(image.get('SAMPLE_BITS', 8))
+    if bits == 8:
+        dtype = np.dtype('u1')
+    else:
+        kind = PDS_SAMPLE_TYPES.get(image.get('SAMPLE_TYPE', '').upper())
+        if kind is None:
+            return None
+        dtype = np.dtype('{}{}'.format(kind, bits // 8))
+
+    return {'path': datapath, 'offset': offset, 'dtype': dtype,
+            'lines': int(image['LINES']),
+            'samples': int(image['LINE_SAMPLES']),
+            'prefix': int(image.get('LINE_PREFIX_BYTES', 0)),
+            'suffix': int(image.get('LINE_SUFFIX_BYTES', 0))}
+
+
+def isislayout(label, path):
+    """
+    Get the raw layout of the first band of a band sequential ISIS3 cube
+
+    Parameters
+    ----------
+    label       (dict) Parsed label
+    path        (str) PATH to the cube
+
+    Returns
+    -------
+    layout      (dict) See pdslayout, or None if the cube is not raw
+    """
+    core = label.get('ISISCUBE', {}).get('CORE')
+    if core is None or '^CORE' in core:
+        return None
+    if core.get('FORMAT', '').upper() != 'BANDSEQUENTIAL':
+        return None
+
+    pixels = core.get('PIXELS', {})
+    kind = ISIS_PIXEL_TYPES.get(pixels.get('TYPE', '').upper())
+    order = ISIS_BYTE_ORDERS.get(pixels.get('BYTEORDER', 'Lsb').upper())
+    if kind is None or order is None:
+        return None
+    dimensions = core.get('DIMENSIONS', {})
+
+    return {'path': path, 'offset': int(core['STARTBYTE']) - 1,
+            'dtype': np.dtype(order + kind),
+            'lines': int(dimensions['LINES']),
+            'samples': int(dimensions['SAMPLES']),
+            'prefix': 0, 'suffix': 0}
+
+
+def getlayout(path):
+    """
+    Parse the label of path and get its raw layout
+
+    Parameters
+    ----------
+    path        (str) PATH to a PDS3 image, detached label or ISIS3 cube
+
+    Returns
+    -------
+    layout      (dict) See pdslayout, or None if the pixels are not raw
+    """
+    try:
+        lines = readlabel(path)
+        if lines is None:
+            return None
+        label = parselabel(lines)
+        if 'ISISCUBE' in label:
+            return isislayout(label, path)
+        return pdslayout(label, path)
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def memmap(path, xsize=None, ysize=None):
+    """
+    Memory map the first band of a raw PDS3 or ISIS3 raster
+
+    Parameters
+    ----------
+    path        (str) PATH to the raster
+    xsize       (int) Expected number of samples, e.g. from GDAL
+    ysize       (int) Expected number of lines, e.g. from GDAL
+
+    Returns
+    -------
+    arr         (ndarray) (lines, samples) copy on write view of the pixels,
+                          or None if the raster can not be mapped
+    """
+    layout = getlayout(path)
+    if layout is None:
+        return None
+    lines = layout['lines']
+    samples = layout['samples']
+    dtype = layout['dtype']
+    if (xsize is not None and xsize != samples) or \
+            (ysize is not None and ysize != lines):
+        return None
+
+    rowbytes = layout['prefix'] + samples * dtype.itemsize + layout['suffix']
+    try:
+        if os.path.getsize(layout['path']) < layout['offset'] + lines * rowbytes:
+            return None
+        raw = np.memmap(layout['path'], dtype=np.uint8, mode='c',
+                        offset=layout['offset'], shape=(lines, rowbytes))
+    except (IOError, OSError, ValueError):
+        return None
+    return np.ndarray((lines, samples), dtype=dtype, buffer=raw,
+                      offset=layout['prefix'],
+                      strides=(rowbytes, dtype.itemsize))
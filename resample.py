@@ -0,0 +1,255 @@
+"""
+NaN aware resampling for DTM arrays.
+
+The resampling is separable: for each axis a sparse matrix of kernel
+weights is computed once and then applied to blocks of output rows.
+No data (NaN, or a supplied validity mask) is handled with normalized
+convolution, i.e. the weights of invalid pixels are dropped and the
+remaining weights renormalized, so a hole never bleeds into its neighbors.
+Blocks are sized to stay under a memory ceiling and are processed on a
+thread pool; NumPy and SciPy release the GIL for the heavy lifting.
+"""
+import math
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+#Interpolation names accepted by resize, mapped onto the kernels below
+INTERPOLATIONS = {'nearest': 'nearest',
+                  'area': 'area',
+                  'linear': 'bilinear',
+                  'bilinear': 'bilinear',
+                  'bicubic': 'cubic',
+                  'cubic': 'cubic',
+                  'lanczos': 'lanczos'}
+
+
+def box(x):
+    return ((x >= -0.5) & (x < 0.5)).astype(np.float64)
+
+
+def triangle(x):
+    return np.maximum(1.0 - np.abs(x), 0.0)
+
+
+def cubic(x, a=-0.5):
+    """
+    Keys cubic convolution kernel, the same kernel used by PIL and GDAL
+    """
+    x = np.abs(x)
+    x2 = x * x
+    x3 = x2 * x
+    near = (a + 2.0) * x3 - (a + 3.0) * x2 + 1.0
+    far = a * x3 - 5.0 * a * x2 + 8.0 * a * x - 4.0 * a
+    return np.where(x < 1.0, near, np.where(x < 2.0, far, 0.0))
+
+
+def lanczos(x, a=3.0):
+    return np.where(np.abs(x) < a, np.sinc(x) * np.sinc(x / a), 0.0)
+
+#Kernel function and support (in source pixels) for each method
+KERNELS = {'area': (box, 0.5),
+           'bilinear': (triangle, 1.0),
+           'cubic': (cubic, 2.0),
+           'lanczos': (lanczos, 3.0)}
+
+
+def getmethod(interpolation):
+    """
+    Normalize an interpolation name
+
+    Parameters
+    ----------
+    interpolation   (str) Interpolation method, case insensitive
+
+    Returns
+    -------
+    method          (str) One of nearest, area, bilinear, cubic, lanczos
+    """
+    if interpolation is None:
+        interpolation = 'cubic'
+    try:
+        return INTERPOLATIONS[interpolation.lower()]
+    except KeyError:
+        raise ValueError("Unknown interpolation method", interpolation)
+
+
+def getweights(insize, outsize, method):
+    """
+    Compute the source indices and weights of every output pixel along one
+    axis.  When downsampling the kernel is stretched by the reduction factor
+    so that every source pixel contributes (antialiasing).
+
+    Parameters
+    ----------
+    insize      (int) Number of input pixels
+    outsize     (int) Number of output pixels
+    method      (str) Normalized method name, see getmethod
+
+    Returns
+    -------
+    idx         (ndarray) (outsize, ntaps) source indices, clamped to the edge
+    weights     (ndarray) (outsize, ntaps) float32 weights summing to one
+    """
+    scale = outsize / float(insize)
+    #Output pixel centers in source pixel coordinates
+    centers = (np.arange(outsize) + 0.5) / scale
+
+    if method == 'nearest':
+        idx = np.minimum(np.floor(centers).astype(np.intp), insize - 1)
+        idx = idx.reshape(-1, 1)
+        return idx, np.ones(idx.shape, dtype=np.float32)
+
+    kernel, support = KERNELS[method]
+    filterscale = max(1.0 / scale, 1.0)
+    support *= filterscale
+    ntaps = int(math.ceil(support)) * 2 + 1
+
+    first = np.floor(centers - support).astype(np.intp)
+    idx = first[:, np.newaxis] + np.arange(ntaps)
+    weights = kernel((idx + 0.5 - centers[:, np.newaxis]) / filterscale)
+    total = weights.sum(axis=1, keepdims=True)
+    total[total == 0] = 1.0
+    weights /= total
+
+    idx = np.clip(idx, 0, insize - 1)
+    return idx, weights.astype(np.float32)
+
+
+def getmatrix(insize, outsize, method):
+    """
+    Build the sparse (outsize, insize) resampling matrix for one axis
+
+    Parameters
+    ----------
+    insize      (int) Number of input pixels
+    outsize     (int) Number of output pixels
+    method      (str) Normalized method name, see getmethod
+
+    Returns
+    -------
+    matrix      (obj) scipy.sparse CSR matrix of float32 weights
+    """
+    idx, weights = getweights(insize, outsize, method)
+    rows = np.repeat(np.arange(outsize), idx.shape[1])
+    return sparse.csr_matrix((weights.ravel(), (rows, idx.ravel())),
+                             shape=(outsize, insize), dtype=np.float32)
+
+
+def getblocksize(inxsize, outxsize, scale, memory, workers):
+    """
+    Estimate how many output rows each worker can process within the memory
+    ceiling.
+
+    Parameters
+    ----------
+    inxsize     (int) Input columns
+    outxsize    (int) Output columns
+    scale       (float) Output rows / input rows
+    memory      (int) Memory ceiling in bytes shared by all workers
+    workers     (int) Number of workers
+
+    Returns
+    -------
+    rows        (int) Output rows per block
+    """
+    #Source slab (data + validity), the vertical pass (num, den, transposed
+    #copy) and the horizontal pass (num, den) per output row, float32
+    rowbytes = 4 * (inxsize * (2.0 / scale + 3) + outxsize * 2)
+    rows = int((memory / float(workers)) // rowbytes)
+    return max(rows, 1)
+
+
+def resize(arr, size, interpolation='cubic', mask=None, workers=None,
+           memory=256 * 1024 ** 2, minweight=0.5):
+    """
+    Resample a 2D array to a new size, honoring no data
+
+    Parameters
+    ----------
+    arr         (ndarray) 2D input array, NaN marks no data
+    size        (list) [xsize, ysize] of the output
+    interpolation (str) nearest, area, (bi)linear, (bi)cubic or lanczos
+    mask        (ndarray) Optional boolean validity mask (True is valid),
+                          used instead of testing arr for NaN
+    workers     (int) Number of threads, defaults to the CPU count
+    memory      (int) Approximate ceiling, in bytes, for the working buffers
+    minweight   (float) Minimum fraction of the kernel that must fall on valid
+                        pixels for an output pixel to be valid
+
+    Returns
+    -------
+    out         (ndarray) (ysize, xsize) float32 array, NaN where invalid
+    """
+    method = getmethod(interpolation)
+    inysize, inxsize = arr.shape
+    outxsize, outysize = size
+
+    if method == 'nearest':
+        yidx = getweights(inysize, outysize, method)[0][:, 0]
+        xidx = getweights(inxsize, outxsize, method)[0][:, 0]
+        out = arr[np.ix_(yidx, xidx)].astype(np.float32)
+        if mask is not None:
+            out[~mask[np.ix_(yidx, xidx)]] = np.nan
+        return out
+
+    ymatrix = getmatrix(inysize, outysize, method)
+    xmatrix = getmatrix(inxsize, outxsize, method)
+
+    if workers is None:
+        #os.cpu_count needs Python 3.4
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    out = np.empty((outysize, outxsize), dtype=np.float32)
+    rows = getblocksize(inxsize, outxsize, outysize / float(inysize),
+                        memory, workers)
+    blocks = [(start, min(start + rows, outysize))
+              for start in range(0, outysize, rows)]
+
+    def resizeblock(block):
+        start, stop = block
+        weights = ymatrix[start:stop]
+        #Only the source rows referenced by this block of output rows
+        top = weights.indices.min()
+        bottom = weights.indices.max() + 1
+        weights = weights[:, top:bottom]
+        slab = arr[top:bottom]
+        if mask is None:
+            valid = ~np.isnan(slab)
+        else:
+            valid = mask[top:bottom]
+
+        if valid.all():
+            out[start:stop] = _separable(slab.astype(np.float32, copy=False),
+                                         weights, xmatrix)
+            return
+
+        data = np.where(valid, slab, 0).astype(np.float32, copy=False)
+        num = _separable(data, weights, xmatrix)
+        den = _separable(valid.astype(np.float32), weights, xmatrix)
+        invalid = den < minweight
+        np.divide(num, den, out=num, where=~invalid)
+        num[invalid] = np.nan
+        out[start:stop] = num
+
+    if workers == 1 or len(blocks) == 1:
+        for block in blocks:
+            resizeblock(block)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(resizeblock, blocks):
+                pass
+    return out
+
+
+def _separable(data, ymatrix, xmatrix):
+    """
+    Apply the vertical and then the horizontal weights to a slab of data
+    """
+    vertical = ymatrix.dot(data)
+    horizontal = xmatrix.dot(np.ascontiguousarray(vertical.T))
+    return horizontal.T
@@ -14,13 +14,25 @@ from bpy_extras.io_utils import ImportHelper
 from SpaceBlender import blender_module
 from SpaceBlender import gdal_module
 from SpaceBlender import flyover_module
+from SpaceBlender import jobdir
+from SpaceBlender import texture as _texture
+
+
+#Color patterns of color_maps, used by -c all
+COLOR_PATTERNS = ['Rainbow_Saturated', 'Rainbow_Medium', 'Rainbow_Light', 'Blue_Steel', 'Earth',
+                  'Diverging_BrownBlue', 'Diverging_RedGray', 'Diverging_BlueRed', 'Diverging_RedBrown',
+                  'Diverging_RedBlue', 'Diverging_GreenRed', 'Sequential_Blue', 'Sequential_Green',
+                  'Sequential_Red', 'Sequential_BlueGreen', 'Sequential_YellowBrown']
 
 
 class SpaceBlender(object):
 
 
     def __init__(self, dtm, resolution, flyover_pattern, color_pattern,
-                 xyscale, interp,zscale, stars, mist, texture):
+                 xyscale, interp,zscale, stars, mist, texture, tiling=None,
+                 mesh_memory=blender_module.MESH_MEMORY, read_threads=1,
+                 read_cachemax=None, jobs=1, cache=True, workdir=None,
+                 texture_scale=None, texture_max=None, texture_encoding=None):
         #Set up the default options for the pipeline
         self.filepath = dtm
         self.resolution = resolution
@@ -33,10 +45,33 @@ class SpaceBlender(object):
         self.stars = stars
         self.mist = mist
         self.texture = texture
+        self.tiling = tiling
+        self.mesh_memory = mesh_memory
+        self.read_threads = read_threads
+        self.read_cachemax = read_cachemax
+        self.jobs = jobs
+        self.cache = cache
+        #Products are published here from a private scratch directory
+        self.workdir = workdir
+        #Texture size as a fraction of the DTM (the mesh's xyscale by default) and
+        #largest texture side in pixels
+        self.texture_scale = xyscale if texture_scale is None else texture_scale
+        self.texture_max = texture_max
+        #One of texture.ENCODINGS, a plain GeoTIFF by default
+        self.texture_encoding = texture_encoding
 
         self.pipeline(bpy.types.Operator)
 
     def pipeline(self, context):
+        #Every run works in its own scratch directory, so concurrent runs sharing
+        #a work directory do not overwrite each other's files
+        job = jobdir.JobDirectory(self.workdir)
+        try:
+            return self.run(context, job)
+        finally:
+            job.cleanup()
+
+    def run(self, context, job):
         input_DEM = self.filepath
 
         #if input_DEM != bpy.path.ensure_ext(input_DEM, ".IMG"):
@@ -44,57 +79,44 @@ class SpaceBlender(object):
         dtm_location = input_DEM
 
         texture_location = ''
-        merge_location =''
         color_file = ''
-        hill_shade = 'hillshade.tiff'
-        color_relief = 'colorrelief.tiff'
+        #Textures rendered after the first one, as (color pattern, texture location)
+        extra_textures = []
+        patterns = self.color_pattern
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
 
         project_location = os.path.dirname(__file__)
         ################################################################################
-        ## Use the GDAL tools to create hill-shade and color-relief and merge them with
-        ## hsv_merge.py to use as a texture for the DTM. Creates DTM_TEXTURE.tiff
+        ## Hill-shade and color-relief the DTM and merge them in HSV, in a single pass
+        ## with texture.build, to use as a texture for the DTM. Creates DTM_TEXTURE.tiff
+        ## With several color patterns the textures are built in the same pass, which
+        ## hill-shades the DTM once.
         ################################################################################
         if self.texture != None:
             texture_location = os.path.join(os.path.dirname(self.filepath), os.path.basename(self.texture))
-        elif self.color_pattern == 'NoColorPattern':
+        elif patterns == ['NoColorPattern']:
             texture_location=None
         else:
-            # If user selected a colr we are going to run the gdal and merge processes
-            # We need to dtermine which OS is being used and set the location of color files
-            # and the merge script accordingly
-            if _platform == "linux" or _platform == "linux2":
-            # linux
-                    # Strip out the image name to set texture location and append color choice.
-                texture_location = self.filepath.split('/')[-1:]
-                texture_location = texture_location[0].split('.')[:1]
-                texture_location = os.getcwd()+'/'+texture_location[0]+'_'+self.color_pattern+'.tiff'
-                color_file = '/usr/share/blender/scripts/addons/SpaceBlender/color_maps/' + self.color_pattern + '.txt'
-                merge_location = '/usr/share/blender/scripts/addons/SpaceBlender/hsv_merge.py'
-            elif _platform == "darwin":
-            # OS X
-                        # Strip out the image name to set texture location and append color choice.
-                texture_location = self.filepath.split('/')[-1:]
-                texture_location = texture_location[0].split('.')[:1]
-                texture_location = os.getcwd()+'/'+texture_location[0]+'_'+self.color_pattern+'.tiff'
-                color_file = '/Applications/Blender/blender.app/Contents/MacOS/2.70/scripts/addons/SpaceBlender/color_maps/'\
-                    + self.color_pattern + '.txt'
-                merge_location = '/Applications/Blender/blender.app/Contents/MacOS/2.70/scripts/addons/SpaceBlender/hsv_merge.py'
-            elif _platform == "win32":
-            # Windows.
-                # Strip out the image name to set texture location and append color choice.
-                texture_location = self.filepath.split('\\')[-1:]
-                texture_location = texture_location[0].split('.')[:1]
-                texture_location = os.getcwd()+'\\'+texture_location[0]+'_'+self.color_pattern+'.tiff'
-                color_file = '"'+'C:\\Program Files\\Blender Foundation\\Blender\\2.69\\scripts\\addons\\SpaceBlender\\color_maps\\'+self.color_pattern + '.txt'+'"'
-                merge_location = '"'+'C:\\Program Files\\Blender Foundation\\Blender\\2.69\scripts\\addons\\SpaceBlender\\hsv_merge.py'+'"'
+            texture_locations = []
+            color_files = []
+            for pattern in patterns:
+                texture_location, color_file = self.texture_paths(pattern, job)
+                texture_locations.append(texture_location)
+                color_files.append(color_file)
 
-            gdal = gdal_module.GDALDriver(dtm_location)
-            gdal.gdal_hillshade(hill_shade)
-            gdal.gdal_color_relief(color_file, color_relief)
-            gdal.hsv_merge(merge_location, hill_shade, color_relief, texture_location)
+            gdal = gdal_module.GDALDriver(dtm_location, jobs=self.jobs, cache=self.cache)
+            #Build in the scratch directory and publish the finished textures
+            texture_names = [os.path.basename(location) for location in texture_locations]
+            gdal.textures(color_files, [job.scratch(name) for name in texture_names],
+                          sample=self.texture_scale, max_size=self.texture_max,
+                          interpolation=self.interp, encoding=self.texture_encoding)
+            for name, location in zip(texture_names, texture_locations):
+                job.publish(name)
+                print('\nSaving texture at: ' + location)
 
-            print('\nSaving texture at: ' + texture_location)
-            gdal.gdal_clean_up(hill_shade, color_relief)
+            texture_location = texture_locations[0]
+            extra_textures = list(zip(patterns[1:], texture_locations[1:]))
 
 
 
@@ -105,7 +127,7 @@ class SpaceBlender(object):
                             scale=self.zscale,
                             image_sample=self.scale,
                             interp_method = self.interp,
-                            color_pattern=self.color_pattern,
+                            color_pattern=','.join(patterns),
                             flyover_pattern=self.flyover_pattern,
                             texture_location=texture_location,
                             cropVars=False,
@@ -113,10 +135,48 @@ class SpaceBlender(object):
                             stars=self.stars,
                             mist=self.mist,
                             render=True,
-                            animation=self.animation)
+                            animation=self.animation,
+                            tiling=self.tiling,
+                            mesh_memory=self.mesh_memory,
+                            read_threads=self.read_threads,
+                            read_cachemax=self.read_cachemax,
+                            job=job,
+                            extra_textures=extra_textures)
 
         return {'FINISHED'}
 
+    def texture_paths(self, color_pattern, job):
+        # We need to dtermine which OS is being used and set the location of color files
+        # accordingly
+        texture_location = ''
+        color_file = ''
+        extension = '.tiff'
+        if self.texture_encoding is not None:
+            extension = _texture.ENCODINGS[self.texture_encoding]['extension']
+        if _platform == "linux" or _platform == "linux2":
+        # linux
+                # Strip out the image name to set texture location and append color choice.
+            texture_location = self.filepath.split('/')[-1:]
+            texture_location = texture_location[0].split('.')[:1]
+            texture_location = job.output_dir+'/'+texture_location[0]+'_'+color_pattern+extension
+            color_file = '/usr/share/blender/scripts/addons/SpaceBlender/color_maps/' + color_pattern + '.txt'
+        elif _platform == "darwin":
+        # OS X
+                    # Strip out the image name to set texture location and append color choice.
+            texture_location = self.filepath.split('/')[-1:]
+            texture_location = texture_location[0].split('.')[:1]
+            texture_location = job.output_dir+'/'+texture_location[0]+'_'+color_pattern+extension
+            color_file = '/Applications/Blender/blender.app/Contents/MacOS/2.70/scripts/addons/SpaceBlender/color_maps/'\
+                + color_pattern + '.txt'
+        elif _platform == "win32":
+        # Windows.
+            # Strip out the image name to set texture location and append color choice.
+            texture_location = self.filepath.split('\\')[-1:]
+            texture_location = texture_location[0].split('.')[:1]
+            texture_location = job.output_dir+'\\'+texture_location[0]+'_'+color_pattern+extension
+            color_file = 'C:\\Program Files\\Blender Foundation\\Blender\\2.69\\scripts\\addons\\SpaceBlender\\color_maps\\'+color_pattern + '.txt'
+        return texture_location, color_file
+
 
 def main():
     import sys
@@ -134,16 +194,51 @@ def main():
     parser.add_argument('-i', '--interp', dest='interp', default='cubic', help="Interpolation method for xy sampling: ['nearest', 'linear', 'bicubic', 'cubic']")
     parser.add_argument('-z', '--zscale', dest='zscale', type=float, default=1.0, help='Percentage to scale the z dimensions, e.g. 0.5 for 50%')
     parser.add_argument('-f', '--flyover', dest='flyover', default='linear', help="Flyover pattern to use:['noflyover', 'linear', 'circle', 'diamond']")
-    parser.add_argument('-c', '--color', dest='color', default='Rainbow_Saturated', help="Color ramp to use:['NoColorPattern','Rainbow_Saturated','Rainbow_Medium','Rainbow_Light','Blue_Steel','Earth','Diverging_BrownBlue','Diverging_RedGray','Diverging_BlueRed','Diverging_RedBrown','Diverging_RedBlue','Diverging_GreenRed','Sequential_Blue','Sequential_Green','Sequential_Red','Sequential_BlueGreen','Sequential_YellowBrown']")
+    parser.add_argument('-c', '--color', dest='color', default='Rainbow_Saturated', help="Color ramp to use, a comma separated list of ramps or all to texture and render each of them:['NoColorPattern','Rainbow_Saturated','Rainbow_Medium','Rainbow_Light','Blue_Steel','Earth','Diverging_BrownBlue','Diverging_RedGray','Diverging_BlueRed','Diverging_RedBrown','Diverging_RedBlue','Diverging_GreenRed','Sequential_Blue','Sequential_Green','Sequential_Red','Sequential_BlueGreen','Sequential_YellowBrown']")
     parser.add_argument('-m', '--mist', dest='mist', action='store_true', help='Render mist (Default: False)')
     parser.add_argument('-a', '--stars', dest='stars', action='store_true', help="Render stars (Default: False)")
     parser.add_argument('-t', '--texture', dest='texture', help='Apply a texture to the input image, e.g. an orthoimage')
+    parser.add_argument('--tile', dest='tiling', choices=['join', 'objects'], help="Build the mesh in tiles, joined into one object or one object per tile (Default: one mesh)")
+    parser.add_argument('--mesh-memory', dest='mesh_memory', type=int, default=1024, help='Memory budget in MB for building the mesh tiles (Default: 1024)')
+    parser.add_argument('--read-threads', dest='read_threads', type=int, default=1, help='Number of threads reading the DTM (Default: 1)')
+    parser.add_argument('--read-cache', dest='read_cache', type=int, help='GDAL block cache in MB per reader thread (Default: the GDAL setting)')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of threads building the texture windows, each reads, hill-shades, colors and merges its own window (Default: 1)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='Always build the texture, do not reuse or store cached textures')
+    parser.add_argument('-w', '--workdir', dest='workdir', help='Directory the texture, .blend and renders are written to, each run works in its own scratch directory inside it (Default: the current directory)')
+    parser.add_argument('--texture-scale', dest='texture_scale', type=float, help='Percentage to scale the texture, e.g. 1.0 for the full DTM resolution (Default: the -s scale of the mesh)')
+    parser.add_argument('--texture-max', dest='texture_max', type=int, help='Largest texture width or height in pixels (Default: no limit)')
+    parser.add_argument('--texture-encoding', dest='texture_encoding', choices=sorted(_texture.ENCODINGS), help='Texture file encoding, tiled and jpegtiff are compressed tiled GeoTIFFs with overviews (Default: gtiff, a plain GeoTIFF)')
     args = parser.parse_args(argv)
 
+    #A comma separated list of color patterns, or all of them
+    if args.color.lower() == 'all':
+        colors = list(COLOR_PATTERNS)
+    else:
+        colors = [color.strip() for color in args.color.split(',') if color.strip()]
+    if not colors:
+        parser.error('-c needs a color pattern')
+    for color in colors:
+        if color == 'NoColorPattern' and len(colors) > 1:
+            parser.error('NoColorPattern can not be combined with other color patterns')
+        if color != 'NoColorPattern' and color not in COLOR_PATTERNS:
+            parser.error('Unknown color pattern ' + color + ', choose from ' + ', '.join(COLOR_PATTERNS))
+    if len(colors) == 1:
+        colors = colors[0]
+
     #Render
     sp = SpaceBlender(args.dtm, args.resolution,args.flyover,
-                      args.color, args.scale, args.interp, args.zscale,
-                      args.stars, args.mist, args.texture)
+                      colors, args.scale, args.interp, args.zscale,
+                      args.stars, args.mist, args.texture,
+                      tiling=args.tiling,
+                      mesh_memory=args.mesh_memory * 1024 ** 2,
+                      read_threads=args.read_threads,
+                      read_cachemax=None if args.read_cache is None else args.read_cache * 1024 ** 2,
+                      jobs=args.jobs,
+                      cache=args.cache,
+                      workdir=args.workdir,
+                      texture_scale=args.texture_scale,
+                      texture_max=args.texture_max,
+                      texture_encoding=args.texture_encoding)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+#Import the GDAL and bpy free modules directly, without the add-on's __init__
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
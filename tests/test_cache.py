@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+
+import cache
+
+
+def test_dem_round_trip(tmp_path):
+    dem = cache.DEMCache(str(tmp_path))
+    #An odd size, the packed mask has padding bits
+    arr = np.arange(35, dtype=np.float32).reshape(5, 7)
+    mask = arr % 3 != 0
+    key = dem.getkey('dtm.img', 0.5, 'cubic')
+    assert dem.load(key) == (None, None, None)
+
+    dem.store(key, arr, mask, {'ndv': -32768.0})
+    out, outmask, meta = dem.load(key)
+    np.testing.assert_array_equal(out, arr)
+    np.testing.assert_array_equal(outmask, mask)
+    assert outmask.dtype == bool
+    assert meta == {'ndv': -32768.0}
+
+    #Copy on write, changing the loaded array leaves the entry alone
+    out[0, 0] = 99
+    np.testing.assert_array_equal(dem.load(key)[0], arr)
+
+
+def test_dem_key(tmp_path):
+    dem = cache.DEMCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'dtm.img')
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 16)
+    key = dem.getdemkey(path, None, None, 0.5, 'Cubic')
+    assert key == dem.getdemkey(path, None, None, 0.5, 'cubic')
+    assert key != dem.getdemkey(path, None, None, 0.25, 'cubic')
+    #Rewriting the DTM changes its identity
+    with open(path, 'ab') as f:
+        f.write(b'\0')
+    assert key != dem.getdemkey(path, None, None, 0.5, 'cubic')
+
+
+def test_eviction(tmp_path):
+    arr = np.zeros((32, 32), dtype=np.float32)
+    mask = np.ones(arr.shape, dtype=bool)
+    #Room for two entries, not three
+    dem = cache.DEMCache(str(tmp_path), maxsize=int(2.5 * arr.nbytes))
+    for i, key in enumerate(['a', 'b']):
+        dem.store(key, arr, mask, {})
+        os.utime(dem.path(key, '.json'), (1000 + i, 1000 + i))
+    #Using a marks it as recently used, b is the least recently used
+    assert dem.load('a')[2] == {}
+    dem.store('c', arr, mask, {})
+
+    assert dem.load('b') == (None, None, None)
+    assert not os.path.exists(dem.path('b', '.npy'))
+    assert dem.load('a')[0] is not None
+    assert dem.load('c')[0] is not None
+
+
+def test_oversized(tmp_path):
+    dem = cache.DEMCache(str(tmp_path), maxsize=1024)
+    dem.store('small', np.zeros(16, dtype=np.float32), np.ones(16, dtype=bool), {})
+    dem.store('big', np.zeros(1024, dtype=np.float32), np.ones(1024, dtype=bool), {})
+    #The big array is not stored and does not evict the small one
+    assert dem.load('big') == (None, None, None)
+    assert dem.load('small')[0] is not None
+
+
+def test_texture_round_trip(tmp_path):
+    textures = cache.TextureCache(str(tmp_path / 'cache'))
+    texture = str(tmp_path / 'texture.tiff')
+    with open(texture, 'wb') as f:
+        f.write(b'texture')
+    out = str(tmp_path / 'out.tiff')
+    assert not textures.load('key', out)
+
+    textures.store('key', texture, {})
+    assert textures.load('key', out)
+    with open(out, 'rb') as f:
+        assert f.read() == b'texture'
+    #A copy, rewriting the output leaves the entry alone
+    with open(out, 'wb') as f:
+        f.write(b'changed')
+    with open(textures.path('key', '.tiff'), 'rb') as f:
+        assert f.read() == b'texture'
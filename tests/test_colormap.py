@@ -0,0 +1,73 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+import colormap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLOR_FILES = sorted(glob.glob(os.path.join(ROOT, 'color_maps', '*.txt')))
+
+
+def interp(z, ramp, zmin, zmax):
+    #Per pixel ramp interpolation, rounded like gdaldem
+    stops, colors = ramp.getstops(zmin, zmax)
+    out = np.empty((3,) + z.shape, dtype=np.uint8)
+    for band in range(3):
+        channel = np.interp(z, stops, colors[:, band].astype(np.float64)) + 0.45
+        np.copyto(out[band], channel, casting='unsafe')
+    return out
+
+
+@pytest.mark.parametrize('color_file', COLOR_FILES,
+                         ids=[os.path.basename(f) for f in COLOR_FILES])
+def test_lut_matches_interp(color_file):
+    ramp = colormap.ColorMap(color_file)
+    zmin, zmax = -8000.0, 6000.0
+    stops = ramp.getstops(zmin, zmax)[0]
+    pad = 0.05 * (stops[-1] - stops[0])
+    z = np.random.RandomState(0).uniform(stops[0] - pad, stops[-1] + pad, 100000)
+    z = z.astype(np.float32)
+    #The ramp's entries themselves and beyond both ends
+    z = np.concatenate([z, stops.astype(np.float32), [zmin, zmax]])
+
+    lut = colormap.compilelut(ramp, zmin, zmax)
+    out = np.empty((3,) + z.shape, dtype=np.uint8)
+    lut.apply(z, out)
+    diff = np.abs(out.astype(np.int16) - interp(z, ramp, zmin, zmax))
+    #Half a table step along the steepest segment, plus one where the
+    #rounding falls the other way
+    stops, colors = ramp.getstops(zmin, zmax)
+    steep = np.abs(np.diff(colors.astype(np.float64), axis=0)).max(axis=1)
+    gaps = np.diff(stops)
+    bound = (steep[gaps > 0] / gaps[gaps > 0]).max() * lut.step / 2 + 1
+    assert diff.max() <= bound
+    assert np.count_nonzero(diff) < 0.01 * diff.size
+
+
+def test_nodata(tmp_path):
+    path = str(tmp_path / 'ramp.txt')
+    with open(path, 'w') as f:
+        f.write('0 0 0 0\n100 200 100 50\nnv 10 20 30\n')
+    lut = colormap.compilelut(colormap.ColorMap(path))
+    z = np.array([np.nan, -1, 0, 50, 100, 1000], dtype=np.float32)
+    out = np.empty((3, z.size), dtype=np.uint8)
+    lut.apply(z, out)
+    np.testing.assert_array_equal(out.T, [(10, 20, 30), (0, 0, 0), (0, 0, 0),
+                                          (100, 50, 25), (200, 100, 50),
+                                          (200, 100, 50)])
+
+
+def test_percent(tmp_path):
+    path = str(tmp_path / 'ramp.txt')
+    with open(path, 'w') as f:
+        f.write('0% black\n100% white\n')
+    ramp = colormap.ColorMap(path)
+    assert ramp.haspercent
+    lut = colormap.compilelut(ramp, 1000.0, 2000.0)
+    assert (lut.zmin, lut.zmax) == (1000.0, 2000.0)
+    z = np.array([1000, 1500, 2000], dtype=np.float32)
+    out = np.empty((3, z.size), dtype=np.uint8)
+    lut.apply(z, out)
+    np.testing.assert_array_equal(out[0], [0, 127, 255])
@@ -0,0 +1,33 @@
+import os
+
+import jobdir
+
+
+def test_publish(tmp_path):
+    output = str(tmp_path / 'out')
+    with jobdir.JobDirectory(output) as job:
+        assert os.path.dirname(job.scratch_dir) == output
+        with open(job.scratch('texture.tiff'), 'w') as f:
+            f.write('new')
+        with open(job.output('texture.tiff'), 'w') as f:
+            f.write('old')
+        with open(job.scratch('partial.tiff'), 'w') as f:
+            f.write('partial')
+
+        assert job.publish('texture.tiff') == os.path.join(output, 'texture.tiff')
+        with open(job.output('texture.tiff')) as f:
+            assert f.read() == 'new'
+        assert not os.path.exists(job.scratch('texture.tiff'))
+    #What was not published goes with the scratch directory
+    assert not os.path.exists(job.scratch_dir)
+    assert os.listdir(output) == ['texture.tiff']
+
+
+def test_concurrent_jobs(tmp_path):
+    first = jobdir.JobDirectory(str(tmp_path))
+    second = jobdir.JobDirectory(str(tmp_path))
+    assert first.scratch_dir != second.scratch_dir
+    first.cleanup()
+    assert os.path.isdir(second.scratch_dir)
+    second.cleanup()
+    assert os.listdir(str(tmp_path)) == []
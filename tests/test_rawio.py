@@ -0,0 +1,170 @@
+import numpy as np
+
+import rawio
+
+
+def writepds(path, label, data, recordbytes=None):
+    """
+    Write an attached label padded to a whole number of records, then data
+    """
+    text = '\r\n'.join(label + ['END']) + '\r\n'
+    text = text.encode('ascii')
+    if recordbytes is not None:
+        text += b' ' * (-len(text) % recordbytes)
+    with open(path, 'wb') as f:
+        f.write(text)
+        f.write(data)
+    return len(text)
+
+
+def imagelabel(pointer, lines, samples, sampletype, bits, extra=()):
+    return (['PDS_VERSION_ID = PDS3',
+             'RECORD_TYPE = FIXED_LENGTH',
+             'RECORD_BYTES = 512',
+             '^IMAGE = ' + pointer,
+             'OBJECT = IMAGE',
+             '  LINES = {}'.format(lines),
+             '  LINE_SAMPLES = {}'.format(samples),
+             '  SAMPLE_TYPE = ' + sampletype,
+             '  SAMPLE_BITS = {}'.format(bits)] +
+            list(extra) +
+            ['END_OBJECT = IMAGE'])
+
+
+def test_record_pointer(tmp_path):
+    arr = np.arange(20, dtype='<f4').reshape(4, 5)
+    path = str(tmp_path / 'dtm.img')
+    #The label fills records 1 and 2, the image starts at record 3
+    size = writepds(path, imagelabel('3', 4, 5, 'PC_REAL', 32),
+                    b'', recordbytes=1024)
+    assert size == 1024
+    with open(path, 'ab') as f:
+        f.write(arr.tobytes())
+
+    layout = rawio.getlayout(path)
+    assert layout['offset'] == 1024
+    assert layout['dtype'] == np.dtype('<f4')
+    np.testing.assert_array_equal(rawio.memmap(path), arr)
+
+
+def test_bytes_pointer(tmp_path):
+    arr = np.arange(-6, 6, dtype='>i2').reshape(3, 4)
+    path = str(tmp_path / 'dtm.img')
+    size = writepds(path, imagelabel('601 <BYTES>', 3, 4, 'MSB_INTEGER', 16),
+                    b'', recordbytes=600)
+    assert size == 600
+    with open(path, 'ab') as f:
+        f.write(arr.tobytes())
+
+    assert rawio.getlayout(path)['offset'] == 600
+    out = rawio.memmap(path)
+    assert out.dtype == np.dtype('>i2')
+    np.testing.assert_array_equal(out, arr)
+
+
+def test_detached_label(tmp_path):
+    arr = np.arange(12, dtype='<u2').reshape(3, 4)
+    with open(str(tmp_path / 'DATA.IMG'), 'wb') as f:
+        f.write(b'\0' * 128 + arr.tobytes())
+
+    for pointer in ['("DATA.IMG", 129 <BYTES>)', '("DATA.IMG", 2)']:
+        path = str(tmp_path / 'DATA.LBL')
+        label = imagelabel(pointer, 3, 4, 'LSB_UNSIGNED_INTEGER', 16)
+        label[2] = 'RECORD_BYTES = 128'
+        writepds(path, label, b'')
+        layout = rawio.getlayout(path)
+        assert layout['path'] == str(tmp_path / 'DATA.IMG')
+        assert layout['offset'] == 128
+        np.testing.assert_array_equal(rawio.memmap(path), arr)
+
+
+def test_prefix_suffix_bytes(tmp_path):
+    arr = np.arange(15, dtype='<f4').reshape(3, 5)
+    rows = np.zeros((3, 4 + 20 + 2), dtype=np.uint8)
+    rows[:, :4] = 0xAA
+    rows[:, 4:24] = arr.view(np.uint8).reshape(3, 20)
+    rows[:, 24:] = 0xBB
+    path = str(tmp_path / 'dtm.img')
+    writepds(path, imagelabel('2', 3, 5, 'PC_REAL', 32,
+                              ['  LINE_PREFIX_BYTES = 4',
+                               '  LINE_SUFFIX_BYTES = 2']),
+             b'', recordbytes=512)
+    with open(path, 'ab') as f:
+        f.write(rows.tobytes())
+
+    np.testing.assert_array_equal(rawio.memmap(path), arr)
+
+
+def test_not_mapped(tmp_path):
+    arr = np.arange(20, dtype='<f4').reshape(4, 5)
+    path = str(tmp_path / 'dtm.img')
+    writepds(path, imagelabel('2', 4, 5, 'PC_REAL', 32), b'', recordbytes=512)
+    with open(path, 'ab') as f:
+        f.write(arr.tobytes())
+    #A different size than GDAL reports
+    assert rawio.memmap(path, xsize=4) is None
+
+    #Truncated data
+    path = str(tmp_path / 'short.img')
+    writepds(path, imagelabel('2', 4, 5, 'PC_REAL', 32), b'', recordbytes=512)
+    with open(path, 'ab') as f:
+        f.write(arr.tobytes()[:-4])
+    assert rawio.memmap(path) is None
+
+    #Compressed
+    path = str(tmp_path / 'compressed.img')
+    writepds(path, imagelabel('2', 4, 5, 'PC_REAL', 32,
+                              ['  ENCODING_TYPE = "DCT_DECOMPRESSED"']),
+             b'', recordbytes=512)
+    assert rawio.memmap(path) is None
+
+    #Not a PVL label
+    path = str(tmp_path / 'dtm.tif')
+    with open(path, 'wb') as f:
+        f.write(b'II*\0' + arr.tobytes())
+    assert rawio.memmap(path) is None
+
+
+def writecube(path, fmt, arr, start=1025):
+    label = ['Object = IsisCube',
+             '  Object = Core',
+             '    StartByte   = {}'.format(start),
+             '    Format      = ' + fmt,
+             '    TileSamples = 128',
+             '    TileLines   = 128',
+             '    Group = Dimensions',
+             '      Samples = {}'.format(arr.shape[1]),
+             '      Lines   = {}'.format(arr.shape[0]),
+             '      Bands   = 1',
+             '    End_Group',
+             '    Group = Pixels',
+             '      Type       = Real',
+             '      ByteOrder  = Lsb',
+             '      Base       = 0.0',
+             '      Multiplier = 1.0',
+             '    End_Group',
+             '  End_Object',
+             'End_Object',
+             'End']
+    text = '\n'.join(label).encode('ascii') + b'\n'
+    with open(path, 'wb') as f:
+        f.write(text + b'\0' * (start - 1 - len(text)))
+        f.write(arr.astype('<f4').tobytes())
+
+
+def test_isis_band_sequential(tmp_path):
+    arr = np.arange(30, dtype='<f4').reshape(5, 6)
+    path = str(tmp_path / 'dtm.cub')
+    writecube(path, 'BandSequential', arr)
+
+    layout = rawio.getlayout(path)
+    assert layout['offset'] == 1024
+    assert (layout['lines'], layout['samples']) == (5, 6)
+    np.testing.assert_array_equal(rawio.memmap(path, 6, 5), arr)
+
+
+def test_isis_tile(tmp_path):
+    path = str(tmp_path / 'dtm.cub')
+    writecube(path, 'Tile', np.zeros((5, 6)))
+    assert rawio.getlayout(path) is None
+    assert rawio.memmap(path) is None
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+import resample
+
+
+@pytest.mark.parametrize('interpolation', ['area', 'bilinear', 'cubic', 'lanczos'])
+def test_hole_does_not_bleed(interpolation):
+    arr = np.full((64, 64), 5.0, dtype=np.float32)
+    arr[20:40, 20:40] = np.nan
+    out = resample.resize(arr, [32, 32], interpolation, workers=2, memory=4096)
+    assert out.shape == (32, 32)
+    valid = ~np.isnan(out)
+    #Only the hole, not its surroundings, turns into no data
+    assert valid[:8].all() and valid[-8:].all()
+    assert not valid[13:17, 13:17].any()
+    np.testing.assert_allclose(out[valid], 5.0, rtol=1e-5)
+
+
+def test_mask():
+    arr = np.full((40, 40), 5.0, dtype=np.float32)
+    arr[10:20, 10:20] = -32768
+    mask = arr != -32768
+    out = resample.resize(arr, [80, 80], 'cubic', mask=mask)
+    nan = arr.copy()
+    nan[~mask] = np.nan
+    np.testing.assert_array_equal(out, resample.resize(nan, [80, 80], 'cubic'))
+    assert np.nanmin(out) > 4.9
+
+    out = resample.resize(arr, [20, 20], 'nearest', mask=mask)
+    assert np.isnan(out[5:10, 5:10]).all()
+    assert np.nanmin(out) == 5.0
+
+
+def test_blocks_match():
+    arr = np.random.RandomState(0).uniform(0, 100, (50, 70)).astype(np.float32)
+    arr[arr > 95] = np.nan
+    whole = resample.resize(arr, [35, 60], 'cubic', workers=1)
+    #One output row per block, on several threads
+    blocks = resample.resize(arr, [35, 60], 'cubic', workers=3, memory=1)
+    np.testing.assert_array_equal(whole, blocks)
+
+
+def test_unknown_interpolation():
+    with pytest.raises(ValueError):
+        resample.getmethod('sinc')
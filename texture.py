@@ -0,0 +1,438 @@
+"""
+Fused terrain texture engine.
+
+The DTM is streamed once in block aligned windows with a one pixel halo.
+For every window the hillshade and the color relief are computed in memory,
+merged in HSV (the hsv_merge kernels) and written to the texture, so no
+intermediate rasters are written.  The hillshade and color relief follow
+gdaldem: Horn's slope, azimuth 315, altitude 45, nodata (0) along the
+raster edges and around no data; color ramps linearly interpolated between
+the entries of a gdaldem color file, clamped outside of them.  buildmany
+colors the windows with several ramps, sharing one hillshade, and with jobs
+builds the windows on several threads.  With sample
+or max_size the DTM is read through a resampled VRT, so the texture is
+computed at (e.g.) the mesh's resolution instead of the DTM's.  The ramp is
+applied through a compiled lookup table (see colormap.py) unless lut is
+False.  The texture is written in one of ENCODINGS: a plain GeoTIFF, a tiled
+and compressed GeoTIFF with internal overviews, PNG or JPEG.
+"""
+import math
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+from . import colormap
+from . import gdalio
+from . import hsv_merge
+from .colormap import ColorMap
+
+#Texture encodings: GDAL driver, creation options, file extension and whether
+#internal overviews are built.  Drivers that can not Create (PNG, JPEG) get a
+#copy of a texture built in /vsimem/.
+ENCODINGS = {
+    'gtiff': {'driver': 'GTiff', 'options': [], 'extension': '.tiff',
+              'overviews': False},
+    'tiled': {'driver': 'GTiff', 'extension': '.tiff', 'overviews': True,
+              'options': ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256',
+                          'COMPRESS=DEFLATE', 'PREDICTOR=2']},
+    'jpegtiff': {'driver': 'GTiff', 'extension': '.tiff', 'overviews': True,
+                 'options': ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256',
+                             'COMPRESS=JPEG', 'PHOTOMETRIC=YCBCR',
+                             'JPEG_QUALITY=90']},
+    'png': {'driver': 'PNG', 'options': ['ZLEVEL=6'], 'extension': '.png',
+            'overviews': False},
+    'jpeg': {'driver': 'JPEG', 'options': ['QUALITY=90'], 'extension': '.jpg',
+             'overviews': False}}
+
+#Overviews are built down to about this size
+OVERVIEW_SIZE = 256
+
+
+def hillshade(win, ewres, nsres, out, z=1.0, scale=1.0, azimuth=315.0,
+              altitude=45.0):
+    """
+    Horn hillshade of the interior of a window, as computed by gdaldem
+
+    Parameters
+    ----------
+    win         (ndarray) (rows + 2, cols + 2) float32 elevations including
+                          a one pixel halo, NaN where there is no data
+    ewres       (float) Geotransform pixel width
+    nsres       (float) Geotransform pixel height (negative for north up)
+    out         (ndarray) (rows, cols) uint8 output, 0 where any pixel of the
+                          3x3 neighborhood is no data
+    z           (float) Vertical exaggeration
+    scale       (float) Ratio of vertical to horizontal units
+    azimuth     (float) Light azimuth in degrees
+    altitude    (float) Light altitude in degrees
+
+    Returns
+    -------
+    out         (ndarray) The hillshade
+    """
+    az = math.radians(azimuth)
+    alt = math.radians(altitude)
+    top = win[:-2]
+    middle = win[1:-1]
+    bottom = win[2:]
+
+    #Horn's weighted differences, west - east and south - north
+    x = (top[:, :-2] + 2 * middle[:, :-2] + bottom[:, :-2]) - \
+        (top[:, 2:] + 2 * middle[:, 2:] + bottom[:, 2:])
+    x *= 1.0 / (8.0 * ewres * scale)
+    y = (bottom[:, :-2] + 2 * bottom[:, 1:-1] + bottom[:, 2:]) - \
+        (top[:, :-2] + 2 * top[:, 1:-1] + top[:, 2:])
+    y *= 1.0 / (8.0 * nsres * scale)
+
+    cang = 254.0 * math.sin(alt) - \
+        (y * (254.0 * math.cos(az) * math.cos(alt) * z) -
+         x * (254.0 * math.sin(az) * math.cos(alt) * z))
+    x *= x
+    y *= y
+    x += y
+    x *= z * z
+    x += 1.0
+    np.sqrt(x, out=x)
+    cang /= x
+
+    #Flat or facing away from the light is 1, valid shades are 1 - 255.  The
+    #kernel does not weigh the center pixel, mask it explicitly.
+    invalid = np.isnan(cang)
+    invalid |= np.isnan(middle[:, 1:-1])
+    np.maximum(cang, 0.0, out=cang)
+    cang += 1.5
+    cang[invalid] = 0
+    np.copyto(out, cang, casting='unsafe')
+    return out
+
+
+def colorrelief(z, stops, colors, nodata, out):
+    """
+    Linearly interpolate the color ramp, clamped to the first and last
+    entries
+
+    Parameters
+    ----------
+    z           (ndarray) (rows, cols) elevations, NaN where there is no data
+    stops       (ndarray) Sorted entry values, see ColorMap.getstops
+    colors      (ndarray) (n, 3) uint8 entry colors
+    nodata      (tuple) Color of no data pixels, None for black
+    out         (ndarray) (3, rows, cols) uint8 output
+
+    Returns
+    -------
+    out         (ndarray) The color relief
+    """
+    invalid = np.isnan(z)
+    for band in range(3):
+        channel = np.interp(z, stops, colors[:, band].astype(np.float64))
+        #gdaldem rounds with + 0.45, no data is replaced below
+        channel += 0.45
+        with np.errstate(invalid='ignore'):
+            np.copyto(out[band], channel, casting='unsafe')
+        out[band][invalid] = 0 if nodata is None else nodata[band]
+    return out
+
+
+def resampled(ds, sample=1.0, max_size=None, interpolation='cubic'):
+    """
+    The DTM at the texture resolution
+
+    Parameters
+    ----------
+    ds          (obj) GDAL dataset of the DTM
+    sample      (float) Fraction of the DTM size, at most 1.  Sizes are
+                        truncated like gdalio.ReadGDAL.getsamplesize so the
+                        texture matches the sampled mesh pixel for pixel
+    max_size    (int) Largest width or height in pixels, None for no limit
+    interpolation (str) Resampling method, see gdalio.getresampling
+
+    Returns
+    -------
+    ds          (obj) ds itself at full resolution, otherwise an in memory
+                      VRT that resamples ds (using its overviews) as it is
+                      read
+    """
+    xsize = ds.RasterXSize
+    ysize = ds.RasterYSize
+    if sample < 1.0:
+        xsize = max(1, int(ds.RasterXSize * sample))
+        ysize = max(1, int(ds.RasterYSize * sample))
+    if max_size is not None and max(xsize, ysize) > max_size:
+        ratio = float(max_size) / max(ds.RasterXSize, ds.RasterYSize)
+        xsize = max(1, min(max_size, int(round(ds.RasterXSize * ratio))))
+        ysize = max(1, min(max_size, int(round(ds.RasterYSize * ratio))))
+    if (xsize, ysize) == (ds.RasterXSize, ds.RasterYSize):
+        return ds
+    return gdal.Translate('', ds, format='VRT', width=xsize, height=ysize,
+                          resampleAlg=gdalio.getresampling(interpolation))
+
+
+def getencoding(encoding=None, format='GTiff', creation_options=None):
+    """
+    Look up an encoding of ENCODINGS, None for format and creation_options
+    """
+    if encoding is None:
+        return {'driver': format, 'options': creation_options or [],
+                'overviews': False}
+    try:
+        return ENCODINGS[encoding]
+    except KeyError:
+        raise ValueError('Unknown texture encoding ' + str(encoding))
+
+
+def create(out_path, xsize, ysize, encoding):
+    """
+    Create a 3 band Byte texture, in /vsimem/ for drivers that can only
+    CreateCopy
+
+    Returns
+    -------
+    outdataset  (obj) Writable GDAL dataset, pass it to finish
+    """
+    driver = gdal.GetDriverByName(encoding['driver'])
+    if driver is None:
+        raise ValueError('GDAL has no ' + encoding['driver'] + ' driver')
+    if driver.GetMetadataItem(gdal.DCAP_CREATE) != 'YES':
+        out_path = '/vsimem/texture_' + uuid.uuid4().hex + '.tif'
+        driver = gdal.GetDriverByName('GTiff')
+        return driver.Create(out_path, xsize, ysize, 3, gdal.GDT_Byte)
+    return driver.Create(out_path, xsize, ysize, 3, gdal.GDT_Byte,
+                         encoding['options'])
+
+
+def finish(outdataset, out_path, encoding):
+    """
+    Build the overviews of a written texture or copy it to its driver
+
+    Returns
+    -------
+    outdataset  (obj) The texture at out_path
+    """
+    if encoding['overviews']:
+        levels = []
+        level = 2
+        while max(outdataset.RasterXSize, outdataset.RasterYSize) // level >= OVERVIEW_SIZE:
+            levels.append(level)
+            level *= 2
+        if levels:
+            outdataset.BuildOverviews('AVERAGE', levels)
+    outdataset.FlushCache()
+    tmp_path = outdataset.GetDescription()
+    if tmp_path == out_path:
+        return outdataset
+    driver = gdal.GetDriverByName(encoding['driver'])
+    copy = driver.CreateCopy(out_path, outdataset, 0, encoding['options'])
+    outdataset = None
+    gdal.Unlink(tmp_path)
+    return copy
+
+
+class _Scratch(object):
+    def __init__(self, shape):
+        """
+        Buffers a worker of buildmany reuses to read, hillshade, color and
+        merge every window, shared by all of the ramps.  There is one per
+        worker, not per ramp.
+
+        Parameters
+        ----------
+        shape       (tuple) (rows, cols) of the largest window
+        """
+        size = shape[0] * shape[1]
+        self.rawbuf = np.empty((shape[0] + 2) * (shape[1] + 2), dtype=np.float32)
+        self.winbuf = np.empty((shape[0] + 2) * (shape[1] + 2), dtype=np.float32)
+        self.hillbuf = np.empty(size, dtype=np.uint8)
+        self.colorbuf = np.empty(3 * size, dtype=np.uint8)
+        self.indexbuf = np.empty(size, dtype=np.intp)
+        self.lutbuf = np.empty(size, dtype=np.float64)
+        self.outbuf = np.empty(3 * size, dtype=np.uint8)
+        self.work = hsv_merge.Workspace(shape)
+
+
+class _Ramp(object):
+    def __init__(self, color_file, zmin, zmax, lut, levels, outdataset):
+        """
+        One color ramp of buildmany: how to color a window and its output
+
+        Parameters
+        ----------
+        color_file  (str) PATH to a gdaldem color relief file
+        zmin        (float) Minimum of the DTM, None unless a ramp needs it
+        zmax        (float) Maximum of the DTM, None unless a ramp needs it
+        lut         (bool) Color through a compiled lookup table
+        levels      (int) Entries of the lookup table
+        outdataset  (obj) The texture
+        """
+        self.colormap = ColorMap(color_file)
+        #Only percentage entries depend on the DTM range, so a ramp colors
+        #the same alone or with others
+        if not self.colormap.haspercent:
+            zmin = zmax = None
+        if lut:
+            self.lut = colormap.getlut(color_file, zmin, zmax, levels)
+        else:
+            self.lut = None
+            self.stops, self.colors = self.colormap.getstops(zmin, zmax)
+        self.outdataset = outdataset
+
+    def render(self, z, hill, x, y, scratch, io):
+        """
+        Color the elevations z of the window at x, y, merge the hillshade
+        and write the window, in the buffers of a _Scratch.  The write holds
+        the io lock.
+        """
+        h, w = z.shape
+        color = hsv_merge.frontview(scratch.colorbuf, (3, h, w))
+        if self.lut is not None:
+            self.lut.apply(z, color, hsv_merge.frontview(scratch.indexbuf, (h, w)),
+                           hsv_merge.frontview(scratch.lutbuf, (h, w)))
+        else:
+            colorrelief(z, self.stops, self.colors, self.colormap.nodata, color)
+        out = hsv_merge.frontview(scratch.outbuf, (3, h, w))
+        hsv_merge.mergeblock(color, hill, 0, out, scratch.work)
+        with io:
+            self.outdataset.WriteRaster(x, y, w, h, out, buf_type=gdal.GDT_Byte,
+                                        band_list=[1, 2, 3])
+
+
+def build(dem, color_file, out_path, **kwargs):
+    """
+    Build a hillshaded color relief texture of a DTM in a single pass, see
+    buildmany for the parameters
+
+    Returns
+    -------
+    outdataset  (obj) The texture, a 3 band Byte GDAL dataset
+    """
+    return buildmany(dem, [color_file], [out_path], **kwargs)[0]
+
+
+def buildmany(dem, color_files, out_paths, format='GTiff', z=1.0, scale=1.0,
+              azimuth=315.0, altitude=45.0, quiet=True, creation_options=None,
+              callback=None, lut=True, levels=None, jobs=1, sample=1.0,
+              max_size=None, interpolation='cubic', encoding=None):
+    """
+    Build hillshaded color relief textures of a DTM in several color ramps
+    in a single pass.  The hillshade of every window is computed once and
+    shared by all of the ramps.
+
+    Parameters
+    ----------
+    dem         (str) PATH to the DTM, or an open GDAL dataset
+    color_files (list) PATHs to gdaldem color relief files
+    out_paths   (list) PATHs of the textures, one per color file
+    format      (str) GDAL driver of the textures
+    z           (float) Hillshade vertical exaggeration
+    scale       (float) Ratio of vertical to horizontal units
+    azimuth     (float) Light azimuth in degrees
+    altitude    (float) Light altitude in degrees
+    quiet       (bool) Do not print progress
+    creation_options (list) GDAL creation options of the textures
+    callback    (callable) GDAL style progress callback, (complete, message,
+                           data), used in place of the terminal progress
+    lut         (bool) Color through a compiled lookup table, False to
+                       interpolate the ramp for every pixel
+    levels      (int) Entries of the lookup table, None for the default of
+                      colormap.compilelut
+    jobs        (int) Threads building windows concurrently, each reads,
+                      hill-shades, colors and merges its window
+    sample      (float) Texture size as a fraction of the DTM size, e.g. the
+                        image_sample of the mesh, at most 1
+    max_size    (int) Largest texture width or height in pixels, None for
+                      no limit
+    interpolation (str) Resampling of the DTM when the texture is smaller,
+                        see gdalio.getresampling
+    encoding    (str) Name of one of ENCODINGS, overrides format and
+                      creation_options
+
+    Returns
+    -------
+    outdatasets (list) The textures, 3 band Byte GDAL datasets
+    """
+    if len(color_files) != len(out_paths):
+        raise ValueError('One output path per color file is required.')
+    ds = resampled(hsv_merge.opendataset(dem), sample, max_size, interpolation)
+    band = ds.GetRasterBand(1)
+    xsize = ds.RasterXSize
+    ysize = ds.RasterYSize
+    ndv = band.GetNoDataValue()
+    geotransform = ds.GetGeoTransform()
+
+    zmin = zmax = None
+    if any(ColorMap(color_file).haspercent for color_file in color_files):
+        zmin, zmax = band.ComputeRasterMinMax(False)
+
+    windows = hsv_merge.getwindows(band)
+    winxsize = max(w for x, y, w, h in windows)
+    winysize = max(h for x, y, w, h in windows)
+
+    encoding = getencoding(encoding, format, creation_options)
+    ramps = []
+    for color_file, out_path in zip(color_files, out_paths):
+        outdataset = create(out_path, xsize, ysize, encoding)
+        outdataset.SetProjection(ds.GetProjection())
+        outdataset.SetGeoTransform(geotransform)
+        ramps.append(_Ramp(color_file, zmin, zmax, lut, levels, outdataset))
+
+    #One set of buffers per worker, handed out through a queue.  GDAL
+    #handles are not thread safe, reads and writes hold the io lock while
+    #the hillshade, colors and merge of the windows run concurrently.
+    workers = max(1, min(jobs, len(windows)))
+    scratches = queue.Queue()
+    for _ in range(workers):
+        scratches.put(_Scratch((winysize, winxsize)))
+    io = threading.Lock()
+
+    def render(window):
+        x, y, w, h = window
+        scratch = scratches.get()
+        try:
+            #Read the window and its halo, clipped to the raster
+            left = min(x, 1)
+            top = min(y, 1)
+            right = min(xsize - x - w, 1)
+            bottom = min(ysize - y - h, 1)
+            readxsize = left + w + right
+            readysize = top + h + bottom
+            raw = hsv_merge.frontview(scratch.rawbuf, (readysize, readxsize))
+            with io:
+                band.ReadAsArray(x - left, y - top, readxsize, readysize, buf_obj=raw)
+            if ndv is not None:
+                raw[raw == ndv] = np.nan
+
+            #Outside of the raster is no data
+            win = hsv_merge.frontview(scratch.winbuf, (h + 2, w + 2))
+            win.fill(np.nan)
+            win[1 - top:h + 1 + bottom, 1 - left:w + 1 + right] = raw
+
+            hill = hillshade(win, geotransform[1], geotransform[5],
+                             hsv_merge.frontview(scratch.hillbuf, (h, w)), z,
+                             scale, azimuth, altitude)
+            #The ramps share the window and its hillshade
+            for ramp in ramps:
+                ramp.render(win[1:-1, 1:-1], hill, x, y, scratch, io)
+        finally:
+            scratches.put(scratch)
+
+    def progress(n):
+        if callback is not None:
+            callback(float(n + 1) / len(windows), '', None)
+        elif not quiet:
+            gdal.TermProgress_nocb(float(n + 1) / len(windows))
+
+    if workers == 1:
+        for n, window in enumerate(windows):
+            render(window)
+            progress(n)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for n, _ in enumerate(executor.map(render, windows)):
+                progress(n)
+
+    return [finish(ramp.outdataset, out_path, encoding)
+            for ramp, out_path in zip(ramps, out_paths)]
@@ -1,11 +1,14 @@
 import glob
 import os
+import queue
 
 import bpy
 from bpy.props import *
 from bpy_extras.io_utils import ImportHelper
 from . import blender_module
 from . import gdal_module
+from . import jobdir
+from . import progress
 from . import flyover_module
 
 
@@ -129,6 +132,22 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
         ('Cubic', 'Cubic', 'Cubic Interpolation')),
         name='Interp.', description='Sampling Interpolation Method', default='Cubic')
 
+    mesh_tiling = EnumProperty(items=(
+        ('None', 'None', 'Build the DTM as one mesh'),
+        ('join', 'Join', 'Build the mesh in tiles and join them'),
+        ('objects', 'Objects', 'Build the mesh in tiles, one object per tile')),
+        name='Tiling', description='Tiled mesh construction for large DTMs', default='None')
+
+    mesh_memory = IntProperty(name='Mesh Memory (MB)',
+                              description='Memory budget for building each mesh tile',
+                              min=64,
+                              default=1024)
+
+    use_cache = BoolProperty(name="Cache Texture",
+                             description="Reuse a texture built before for the same DTM and color",
+                             default=True
+                             )
+
     objectslist = EnumProperty(attr="obj_list", name="Objects", description="Choose object to edit", items=listObjects)
 
     def draw(self, context):
@@ -138,7 +157,8 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
         layout = self.layout
         modules = ['image_sample', 'interp_method', 'scale',
                    'color_pattern', 'ortho', 'objectslist',
-                   'resolution','flyover_pattern', 'stars', 'mist']
+                   'resolution','flyover_pattern', 'stars', 'mist',
+                   'mesh_tiling', 'mesh_memory', 'use_cache']
         for m in modules:
             layout.prop(self, m)
 
@@ -154,8 +174,8 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
 
         project_location = os.path.dirname(__file__)
         ################################################################################
-        ## Use the GDAL tools to create hill-shade and color-relief and merge them with
-        ## hsv_merge.py to use as a texture for the DTM. Creates DTM_TEXTURE.tiff
+        ## Hill-shade and color-relief the DTM and merge them in HSV, in a single pass
+        ## with texture.build, to use as a texture for the DTM. Creates DTM_TEXTURE.tiff
         ################################################################################
         if self.ortho == True:
             texture_location = self.objectslist
@@ -164,19 +184,44 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
             texture_location=None
             pass
         else:
-            color_file = os.path.normpath("\"" + project_location + "/color_maps/" + self.color_pattern + ".txt\"")
-            merge_location = os.path.normpath("\"" + project_location + "/hsv_merge.py\"")
+            color_file = os.path.normpath(project_location + "/color_maps/" + self.color_pattern + ".txt")
             texture_location = os.path.normpath(dtm_location + ".tiff")
-            hill_shade = os.path.normpath("\""+project_location+"/maps/hillshade.tiff\"")
-            color_relief = os.path.normpath("\""+project_location+"/maps/colorrelief.tiff\"")
 
-            gdal = gdal_module.GDALDriver(dtm_location)
-            gdal.gdal_hillshade(hill_shade)
-            gdal.gdal_color_relief(color_file, color_relief)
-            gdal.hsv_merge(merge_location, hill_shade, color_relief, texture_location)
+            #Report the texture build on the console and the Blender progress cursor.
+            #Events may come from the texture threads, they are queued and the
+            #cursor is updated from this (the main) thread, the only one touching bpy
+            wm = context.window_manager
+            events = queue.Queue()
+            reporter = progress.console()
+            reporter.subscribe(progress.queue_subscriber(events))
+            wm.progress_begin(0, 100)
+            #Build next to the DTM in a private scratch directory and publish the finished texture
+            job = jobdir.JobDirectory(os.path.dirname(texture_location))
+            try:
+                texture_name = os.path.basename(texture_location)
+                gdal = gdal_module.GDALDriver(dtm_location, progress=reporter, cache=self.use_cache)
+                #The texture is built at the resolution of the sampled mesh, on a
+                #worker thread while this thread drains the progress events
+                built = gdal.texture_async(color_file, job.scratch(texture_name),
+                                           sample=self.image_sample,
+                                           interpolation=self.interp_method)
+                while not built.done() or not events.empty():
+                    try:
+                        event = events.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    wm.progress_update(int(event.fraction * 100))
+                try:
+                    built.result()
+                except (IOError, OSError, ValueError) as e:
+                    self.report({'ERROR'}, 'Failed to build the texture: ' + str(e))
+                    return {'CANCELLED'}
+                job.publish(texture_name)
+            finally:
+                job.cleanup()
+                wm.progress_end()
 
             print('\nSaving texture at: ' + texture_location)
-            gdal.gdal_clean_up(hill_shade, color_relief)
         ################################################################################
         ####################Execute DEM Importer and Blender Module#####################
         blender_module.load(self, context,
@@ -192,5 +237,7 @@ class UI_Driver(bpy.types.Operator, ImportHelper):
                             stars=self.stars,
                             mist=self.mist,
                             render=False,
-                            animation=False)
+                            animation=False,
+                            tiling=None if self.mesh_tiling == 'None' else self.mesh_tiling,
+                            mesh_memory=self.mesh_memory * 1024 ** 2)
         return {'FINISHED'}